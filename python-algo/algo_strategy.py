@@ -3,7 +3,6 @@ import random
 import math
 import warnings
 from sys import maxsize
-import json
 
 
 """
@@ -15,13 +14,17 @@ Advanced strategy tips:
   - You can analyze action frames by modifying on_action_frame function
 
   - The GameState.map object can be manually manipulated to create hypothetical 
-  board states. Though, we recommended making a copy of the map to preserve 
-  the actual current map state.
+  board states. Though, we recommended making a copy with GameState.fork() to 
+  preserve the actual current map state.
 """
 
 class AlgoStrategy(gamelib.AlgoCore):
     def __init__(self):
         super().__init__()
+        # Have AlgoCore pass the messages it already decoded, instead of strings we would decode again
+        self.decoded_messages = True
+        # on_action_frame only looks at breaches, so frames without one are skipped
+        self.subscribe_frames(events=["breach"])
         seed = random.randrange(maxsize)
         random.seed(seed)
         gamelib.debug_write('Random seed: {}'.format(seed))
@@ -31,14 +34,15 @@ class AlgoStrategy(gamelib.AlgoCore):
         Read in config and perform any initial setup here 
         """
         gamelib.debug_write('Configuring your custom algo strategy...')
-        self.config = config
+        # Sets self.config and self.unit_types, the unit types read from the config
+        super().on_game_start(config)
         global WALL, FACTORY, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, MP, SP
-        WALL = config["unitInformation"][0]["shorthand"]
-        FACTORY = config["unitInformation"][1]["shorthand"]
-        TURRET = config["unitInformation"][2]["shorthand"]
-        SCOUT = config["unitInformation"][3]["shorthand"]
-        DEMOLISHER = config["unitInformation"][4]["shorthand"]
-        INTERCEPTOR = config["unitInformation"][5]["shorthand"]
+        WALL = self.unit_types.WALL
+        FACTORY = self.unit_types.FACTORY
+        TURRET = self.unit_types.TURRET
+        SCOUT = self.unit_types.SCOUT
+        DEMOLISHER = self.unit_types.DEMOLISHER
+        INTERCEPTOR = self.unit_types.INTERCEPTOR
         MP = 1
         SP = 0
         # This is a good place to do initial setup
@@ -52,7 +56,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         unit deployments, and transmitting your intended deployments to the
         game engine.
         """
-        game_state = gamelib.GameState(self.config, turn_state)
+        game_state = gamelib.GameState.from_parsed(self.config, turn_state, turn_budget=self.turn_budget)
         gamelib.debug_write('Performing turn {} of your custom algo strategy'.format(game_state.turn_number))
         game_state.suppress_warnings(True)  #Comment or remove this line to enable warnings.
 
@@ -186,22 +190,18 @@ class AlgoStrategy(gamelib.AlgoCore):
         # Get the damage estimate each path will take
         for location in location_options:
             path = game_state.find_path_to_edge(location)
-            damage = 0
-            for path_location in path:
-                # Get number of enemy turrets that can attack each location and multiply by turret damage
-                damage += len(game_state.get_attackers(path_location, 0)) * gamelib.GameUnit(TURRET, game_state.config).damage_i
-            damages.append(damage)
+            # Sums the damage of the enemy turrets that can attack each location, for every frame a scout spends there
+            damages.append(game_state.evaluate_path_damage(path, SCOUT))
         
         # Now just return the location that takes the least damage
         return location_options[damages.index(min(damages))]
 
     def detect_enemy_unit(self, game_state, unit_type=None, valid_x = None, valid_y = None):
         total_units = 0
-        for location in game_state.game_map:
-            if game_state.contains_stationary_unit(location):
-                for unit in game_state.game_map[location]:
-                    if unit.player_index == 1 and (unit_type is None or unit.unit_type == unit_type) and (valid_x is None or location[0] in valid_x) and (valid_y is None or location[1] in valid_y):
-                        total_units += 1
+        for location in game_state.game_map.iter_structures(1):
+            for unit in game_state.game_map[location]:
+                if unit.player_index == 1 and (unit_type is None or unit.unit_type == unit_type) and (valid_x is None or location[0] in valid_x) and (valid_y is None or location[1] in valid_y):
+                    total_units += 1
         return total_units
         
     def filter_blocked_locations(self, locations, game_state):
@@ -211,7 +211,7 @@ class AlgoStrategy(gamelib.AlgoCore):
                 filtered.append(location)
         return filtered
 
-    def on_action_frame(self, turn_string):
+    def on_action_frame(self, state):
         """
         This is the action frame of the game. This function could be called 
         hundreds of times per turn and could slow the algo down so avoid putting slow code here.
@@ -219,7 +219,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         Full doc on format of a game frame at: https://docs.c1games.com/json-docs.html
         """
         # Let's record at what position we get scored on
-        state = json.loads(turn_string)
+        # The frame only holds the breach events because of subscribe_frames in __init__
         events = state["events"]
         breaches = events["breach"]
         for breach in breaches:
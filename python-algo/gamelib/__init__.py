@@ -7,15 +7,33 @@ It contains functions that let you get information about resources, deploy units
 The GameMap class in game_map.py represents the current game map. It can be used to access information related to the locations of units. 
 Investigating it is useful for any player that wants to access more information about the current state of the game. \n
 
+The CoverageMap class in coverage.py records the units that can attack every location of the map.
+GameState builds and caches one per player, and uses it to answer get_attackers. \n
+
+The TargetIndex class in targeting.py buckets the units of each player by location. 
+GameState builds and caches one, and uses it to answer get_targets for many attackers at once. \n
+
 The GameUnit class in unit.py represetns a single unit. 
 Investigating it is useful for any player that wants to access information about units. \n
 
+The UnitStore class in unit_store.py holds every unit of a GameMap as parallel numpy arrays, for queries over all units at once. \n
+
+The UnitTypeRegistry class in unit_types.py holds the unit type constants, ids, categories and costs read from the config. 
+AlgoCore builds it once in on_game_start and every GameState with the same config shares it. \n
+
 The AlgoCore class in algocore.py handles communication with the game engine, and forms the bones of an algo. AlgoStrategy inherits from it. 
 Investigating it is useful for advanced players interested in getting data from the action phase or communicating directly with the game engine. \n
 
+The BackgroundPlan class in planning.py runs AlgoCore.plan_next_turn in a worker thread during the action phase. \n
+
+The FrameSubscription class in frames.py lets AlgoCore skip action frames and decode only the parts a strategy subscribed to. \n
+
 The Navigation class in navigation.py contains functions related to pathfinding, which are used by GameState in pathing related functions. 
 Investigating it is useful for advanced player who want to optimize the slow default pathing algorithm we provide. \n 
 
+The ArenaTopology class in topology.py holds precomputed indices, neighbors and edges of the arena's locations.
+It is shared by GameMap and the pathfinders to avoid recomputing bounds checks. \n
+
 util.py contains a small handful of functions that help with communication, including the debug-printing function, debug_write().
 """
 
@@ -25,5 +43,5 @@ from .game_state import GameState
 from .unit import GameUnit
 from .game_map import GameMap
 
-__all__ = ["algocore", "game_state", "game_map", "navigation", "unit", "util"]
+__all__ = ["algocore", "coverage", "frames", "game_state", "game_map", "navigation", "planning", "targeting", "topology", "unit", "unit_store", "unit_types", "util"]
  
\ No newline at end of file
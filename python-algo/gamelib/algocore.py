@@ -1,6 +1,10 @@
 import json
+import time
 
 from .game_state import GameState
+from .unit_types import get_unit_type_registry
+from .frames import FrameSubscription
+from .planning import BackgroundPlan, TurnBudget
 from .util import get_command, debug_write, BANNER_TEXT, send_command
 
 class AlgoCore(object):
@@ -10,27 +14,57 @@ class AlgoCore(object):
 
     Attributes :
         * config (JSON): json object containing information about the game
+        * unit_types (:obj: UnitTypeRegistry): The unit types of the config, set by on_game_start
+        * decoded_messages (bool): If true, on_turn and on_action_frame are passed the dict AlgoCore
+          already decoded from each message instead of the raw string, so it is not decoded twice
+        * frame_subscription (:obj: FrameSubscription): The parts of action frames on_action_frame needs, set by subscribe_frames.
+          None passes every frame
+        * background_planning (bool): If true, plan_next_turn is run in a worker thread during each action phase
+        * background_timeout (float): How long, in seconds, to wait for plan_next_turn to stop when the next turn arrives
+        * background_result: The result of the last background plan, available in on_turn. None if there was none
+        * turn_budget (:obj: TurnBudget): The time budget of the current turn, created when the turn message arrives
+        * turn_time_limit (float): The length of each turn budget in seconds. If None, the soft time limit in the config is used
+        * turn_watchdog (bool): If true, the turn budget submits the best offered turn watchdog_margin seconds before it runs out.
+          Build the GameState in on_turn with turn_budget=self.turn_budget so its submit_turn goes through the same budget
+          and the turn is never sent twice. Turns sent any other way bypass the budget
+        * watchdog_margin (float): How many seconds before the deadline the watchdog submits
 
     """
     def __init__(self):
         self.config = None
+        self.unit_types = None
+        self.decoded_messages = False
+        self.frame_subscription = None
+        self.background_planning = False
+        self.background_timeout = 0.1
+        self.background_result = None
+        self._background_plan = None
+        self.turn_budget = None
+        self.turn_time_limit = None
+        self.turn_watchdog = False
+        self.watchdog_margin = 0.5
 
     def on_game_start(self, config):
         """
         This function is called once at the start of the game. 
-        By default, it just initializes the config. \n
+        By default, it initializes the config and the unit type registry built from it. \n
         You can override it it in algo_strategy.py to perform start of game setup
         """
         self.config = config
+        self.unit_types = get_unit_type_registry(config)
 
     def on_turn(self, game_state):
         """
         This step function is called at the start of each turn.
         It is passed the current game state, which can be used to initiate a new GameState object. 
-        By default, it sends empty commands to the game engine. \n
+        The game state is a string, or a dict if decoded_messages is true. GameState accepts either. 
+        By default, it sends empty commands to the game engine, through the turn budget if there is one. \n
         algo_strategy.py inherits from AlgoCore and overrides this on turn function. 
         Adjusting the on_turn function in algo_strategy is the main way to adjust your algo's logic. 
         """
+        if self.turn_budget is not None:
+            self.turn_budget.submit()
+            return
         send_command("[]")
         send_command("[]")
     
@@ -40,9 +74,69 @@ class AlgoCore(object):
         The action phase is made up of a sequence of distinct frames. 
         Each of these frames is sent to the algo in order. 
         They can be handled in this function. 
+        Frames are passed as strings, or as dicts if decoded_messages is true. 
+        After subscribe_frames, they are passed as dicts holding only the subscribed parts. 
         """
         pass
 
+    def subscribe_frames(self, events=None, fields=None):
+        """
+        Declares which parts of the action frames on_action_frame uses. 
+        Frames without any of the given events are skipped after a quick scan of the raw message, 
+        and the other frames are passed to on_action_frame as a dict with only turnInfo, 
+        the given fields and the given lists in "events". \n
+        For example, subscribe_frames(events=["breach"]) only calls on_action_frame for frames with a breach.
+
+        Args:
+            events: Event kinds to receive, such as "breach" or "death". If empty, every frame is passed
+            fields: Top level fields of the frame to receive, such as "p1Stats" or "p2Units"
+
+        """
+        self.frame_subscription = FrameSubscription(events or (), fields or ())
+
+    def plan_next_turn(self, plan):
+        """
+        If background_planning is true, this function is called in a worker thread on the first action frame of each turn. 
+        It can use the time the engine spends sending action frames to prepare the next turn. 
+        plan.predicted_state() builds a GameState for the next turn from the latest frame. \n
+        Return the result, or store it in plan.result as you go. It is passed to on_turn in self.background_result. 
+        When the next turn arrives plan.cancelled is set, so call plan.check() regularly and return soon after. 
+        A worker still running background_timeout seconds later is abandoned, and the result stored so far is used.
+
+        Args:
+            plan: The BackgroundPlan for the current action phase
+
+        """
+        return None
+
+    def __track_action_frame(self, frame):
+        if not self.background_planning:
+            return
+        if self._background_plan is None:
+            self._background_plan = BackgroundPlan(self.config, frame)
+            self._background_plan.start(self.plan_next_turn)
+        else:
+            self._background_plan.update(frame)
+
+    def __start_turn_budget(self, received):
+        limit = self.turn_time_limit
+        if limit is None:
+            limit = self.config.get("timingAndReplay", {}).get("waitTimeBotSoft", 5000) / 1000
+        self.turn_budget = TurnBudget(limit, received)
+        if self.turn_watchdog:
+            self.turn_budget.start_watchdog(self.watchdog_margin)
+
+    def __finish_background_plan(self):
+        plan = self._background_plan
+        self._background_plan = None
+        if plan is None:
+            self.background_result = None
+            return
+        if not plan.cancel(self.background_timeout):
+            plan.abandon()
+            debug_write("Background planning did not stop within {} seconds, using its last result".format(self.background_timeout))
+        self.background_result = plan.result
+
 
     def start(self):
         """ 
@@ -57,6 +151,7 @@ class AlgoCore(object):
             # Note: Python blocks and hangs on stdin. Can cause issues if connections aren't setup properly and may need to
             # manually kill this Python program.
             game_state_string = get_command()
+            received = time.perf_counter()
             if "replaySave" in game_state_string:
                 """
                 This means this must be the config file. So, load in the config file as a json and add it to your AlgoStrategy class.
@@ -64,6 +159,15 @@ class AlgoCore(object):
                 parsed_config = json.loads(game_state_string)
                 self.on_game_start(parsed_config)
             elif "turnInfo" in game_state_string:
+                if self.frame_subscription is not None and self.frame_subscription.state_type(game_state_string) == 1:
+                    """
+                    Only decode the parts of the action frame the algo subscribed to, and skip frames it does not need
+                    """
+                    self.__track_action_frame(game_state_string)
+                    frame = self.frame_subscription.decode(game_state_string)
+                    if frame is not None:
+                        self.on_action_frame(frame)
+                    continue
                 state = json.loads(game_state_string)
                 stateType = int(state.get("turnInfo")[0])
                 if stateType == 0:
@@ -71,16 +175,23 @@ class AlgoCore(object):
                     This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
                     deploy phase. Printing is handled by the provided functions.
                     """
-                    self.on_turn(game_state_string)
+                    self.__start_turn_budget(received)
+                    self.__finish_background_plan()
+                    try:
+                        self.on_turn(state if self.decoded_messages else game_state_string)
+                    finally:
+                        self.turn_budget.cancel()
                 elif stateType == 1:
                     """
                     If stateType == 1, this game_state_string string represents a single frame of an action phase
                     """
-                    self.on_action_frame(game_state_string)
+                    self.__track_action_frame(game_state_string)
+                    self.on_action_frame(state if self.decoded_messages else game_state_string)
                 elif stateType == 2:
                     """
                     This is the end game message. This means the game is over so break and finish the program.
                     """
+                    self.__finish_background_plan()
                     debug_write("Got end state, game over. Stopping algo.")
                     break
                 else:
@@ -0,0 +1,211 @@
+import bisect
+import math
+
+_kernels = {}
+
+
+def get_coverage_kernel(topology, attack_range, search_range):
+    """Gets the locations a unit with a given attack range can hit from each location
+
+    Args:
+        topology: The ArenaTopology of the map
+        attack_range: The attack range of the unit
+        search_range: Only locations closer than this are included, like GameMap.get_locations_in_range
+
+    Returns:
+        A tuple where entry i holds the indices that can be hit from the location with index i
+
+    """
+    key = (topology.ARENA_SIZE, attack_range, search_range)
+    if key not in _kernels:
+        offset_range = math.ceil(attack_range)
+        offsets = []
+        for dx in range(-offset_range, offset_range + 1):
+            for dy in range(-offset_range, offset_range + 1):
+                distance = math.sqrt(dx ** 2 + dy ** 2)
+                if distance <= attack_range and distance < search_range:
+                    offsets.append((dx, dy))
+        kernel = []
+        for x, y in topology.index_location:
+            covered = []
+            for dx, dy in offsets:
+                if topology.in_bounds((x + dx, y + dy)):
+                    covered.append(topology.location_index[x + dx][y + dy])
+            kernel.append(tuple(covered))
+        _kernels[key] = tuple(kernel)
+    return _kernels[key]
+
+
+class CoverageMap:
+    """The units that can attack or shield each location, from the point of view of one defending player
+
+    Built for every location at once by spreading each attacking unit over the locations
+    in its range. GameState.get_coverage_map keeps one per player. When the GameMap changes,
+    update() re-spreads only the units at the locations the map reports as changed, and
+    GameState rebuilds the coverage map if that is not possible. Values are stored in lists indexed by topology index.
+
+    Attributes :
+        * player_index (int): The defending player, 0 for you 1 for the enemy
+        * version (int): The GameMap version this map is up to date with
+        * attackers (list): attackers[i] is the list of units that would attack a unit of player_index at index i
+        * count (list): count[i] is the number of attackers of index i
+        * damage (list): damage[i] is the summed damage the attackers of index i deal to a mobile unit each attack
+        * shielders (list): shielders[i] is the list of friendly structures that would shield a mobile unit at index i
+
+    """
+    def __init__(self, game_map, player_index, search_range):
+        """Builds the coverage map
+
+        Args:
+            game_map: The GameMap to read units from
+            player_index: The index corresponding to the defending player
+            search_range: Only locations closer than this to a unit are covered by it
+
+        """
+        self.game_map = game_map
+        self.topology = game_map.topology
+        self.player_index = player_index
+        self.version = game_map.version
+        self.search_range = search_range
+
+        size = self.topology.size
+        self.attackers = [[] for index in range(size)]
+        self.count = [0] * size
+        self.damage = [0] * size
+        self.shielders = [[] for index in range(size)]
+        # Each list above has a parallel list of the x-major keys of the locations its units stand on,
+        # which keeps the units ordered like the scan in get_attackers as they are added and removed
+        self.__attacker_keys = [[] for index in range(size)]
+        self.__shielder_keys = [[] for index in range(size)]
+        self.__covered = {}
+
+        # Sorted so the locations are added column by column, like the scan in get_attackers
+        for x, y in sorted(game_map.iter_occupied()):
+            self.__add_location(x, y, building=True)
+
+    def update(self, max_changes=32):
+        """Brings the map up to date with game_map by re-spreading the units at the locations that changed
+
+        Args:
+            max_changes: The most changed locations to re-spread. Past that, rebuilding is about as fast
+
+        Returns:
+            True if the map is up to date, False if game_map could not say what changed and the map should be rebuilt
+
+        """
+        if self.version == self.game_map.version:
+            return True
+        changes = self.game_map._changes_since(self.version)
+        if changes is None or len(changes) > max_changes:
+            return False
+        for x, y in set(changes):
+            self.__remove_location(x, y)
+            self.__add_location(x, y)
+        self.version = self.game_map.version
+        return True
+
+    def __add_location(self, x, y, building=False):
+        key = x * self.topology.ARENA_SIZE + y
+        index = self.topology.location_index[x][y]
+        attacked = set()
+        shielded = set()
+        for unit in self.game_map._units_at(x, y):
+            if unit.damage_i + unit.damage_f > 0 and unit.player_index != self.player_index:
+                kernel = get_coverage_kernel(self.topology, unit.attackRange, self.search_range)[index]
+                self.__insert(self.attackers, self.__attacker_keys, kernel, key, unit)
+                attacked.update(kernel)
+                if building:
+                    # While building, units are only appended, so adding up as we go matches __recount
+                    damage_i = unit.damage_i
+                    for covered in kernel:
+                        self.count[covered] += 1
+                        self.damage[covered] += damage_i
+            if unit.stationary and unit.shieldPerUnit > 0 and unit.shieldRange > 0 and unit.player_index == self.player_index:
+                covered = self.game_map.get_location_indices_in_range([x, y], unit.shieldRange)
+                self.__insert(self.shielders, self.__shielder_keys, covered, key, unit)
+                shielded.update(covered)
+        if attacked or shielded:
+            self.__covered[key] = (attacked, shielded)
+            if not building:
+                for covered in attacked:
+                    self.__recount(covered)
+
+    def __remove_location(self, x, y):
+        key = x * self.topology.ARENA_SIZE + y
+        if key not in self.__covered:
+            return
+        attacked, shielded = self.__covered.pop(key)
+        for covered in attacked:
+            self.__delete(self.attackers[covered], self.__attacker_keys[covered], key)
+            self.__recount(covered)
+        for covered in shielded:
+            self.__delete(self.shielders[covered], self.__shielder_keys[covered], key)
+
+    @staticmethod
+    def __insert(lists, key_lists, indices, key, unit):
+        for index in indices:
+            units = lists[index]
+            keys = key_lists[index]
+            if not keys or keys[-1] <= key:
+                units.append(unit)
+                keys.append(key)
+            else:
+                position = bisect.bisect_right(keys, key)
+                units.insert(position, unit)
+                keys.insert(position, key)
+
+    @staticmethod
+    def __delete(units, keys, key):
+        start = bisect.bisect_left(keys, key)
+        end = bisect.bisect_right(keys, key, start)
+        del units[start:end]
+        del keys[start:end]
+
+    def __recount(self, index):
+        # Summed in list order from 0, so the totals match a map built from scratch exactly
+        damage = 0
+        for unit in self.attackers[index]:
+            damage += unit.damage_i
+        self.count[index] = len(self.attackers[index])
+        self.damage[index] = damage
+
+    def get_attackers(self, location):
+        """Gets the units that would attack a unit at a location
+
+        Args:
+            location: A map location
+
+        Returns:
+            A list of attacking units, or an empty list if the location is not in the arena
+
+        """
+        index = self.topology.index(location)
+        if index < 0:
+            return []
+        return list(self.attackers[index])
+
+    def get_count(self, location):
+        """Gets the number of units that would attack a unit at a location
+
+        Args:
+            location: A map location
+
+        Returns:
+            The number of attackers, 0 if the location is not in the arena
+
+        """
+        index = self.topology.index(location)
+        return self.count[index] if index >= 0 else 0
+
+    def get_damage(self, location):
+        """Gets the damage a mobile unit at a location would take from each attack of its attackers
+
+        Args:
+            location: A map location
+
+        Returns:
+            The summed damage of the attackers, 0 if the location is not in the arena
+
+        """
+        index = self.topology.index(location)
+        return self.damage[index] if index >= 0 else 0
@@ -0,0 +1,104 @@
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_empty_list = re.compile(r'\[\s*\]')
+
+
+class FrameSubscription:
+    """Decodes only the parts of action frames a strategy has asked for
+
+    Frames are scanned as raw strings. A frame is skipped without being decoded if none of the
+    subscribed events happened in it, and otherwise only turnInfo, the subscribed fields and
+    the subscribed event lists are decoded. This relies on the keys being unique within a frame,
+    which holds for the messages sent by the game engine. Use AlgoCore.subscribe_frames to create one.
+
+    Attributes :
+        * events (tuple): The event kinds to decode, such as "breach" or "death". If empty, no frame is skipped
+        * fields (tuple): The top level fields to decode, such as "p1Stats" or "p1Units"
+
+    """
+    def __init__(self, events=(), fields=()):
+        """Sets up the subscription
+
+        Args:
+            events: The event kinds to decode
+            fields: The top level fields to decode
+
+        """
+        self.events = tuple(events)
+        self.fields = tuple(fields)
+        self.__patterns = {}
+
+    def __find_value(self, line, key):
+        """Finds where the value of a key starts in a raw frame, or returns -1
+        """
+        pattern = self.__patterns.get(key)
+        if pattern is None:
+            pattern = re.compile(r'"{}"\s*:\s*'.format(re.escape(key)))
+            self.__patterns[key] = pattern
+        match = pattern.search(line)
+        return match.end() if match else -1
+
+    def __decode_value(self, line, key):
+        start = self.__find_value(line, key)
+        if start < 0:
+            return None
+        return _decoder.raw_decode(line, start)[0]
+
+    def state_type(self, line):
+        """Reads the message type from turnInfo without decoding the rest of the message
+
+        Args:
+            line: A raw message from the game engine
+
+        Returns:
+            The message type, 1 for action frames, or None if the message has no turnInfo
+
+        """
+        turn_info = self.__decode_value(line, "turnInfo")
+        if not turn_info:
+            return None
+        return int(turn_info[0])
+
+    def has_events(self, line):
+        """Checks if an action frame has any of the subscribed events, without decoding it
+
+        Args:
+            line: A raw action frame
+
+        Returns:
+            True if one of the subscribed event lists is not empty, or if no events were subscribed
+
+        """
+        if not self.events:
+            return True
+        for kind in self.events:
+            start = self.__find_value(line, kind)
+            if start >= 0 and not _empty_list.match(line, start):
+                return True
+        return False
+
+    def decode(self, line):
+        """Decodes the subscribed parts of an action frame
+
+        Args:
+            line: A raw action frame
+
+        Returns:
+            A dict with turnInfo, the subscribed fields and an events dict holding the subscribed
+            event lists, or None if the frame has none of the subscribed events
+
+        """
+        if not self.has_events(line):
+            return None
+        frame = {"turnInfo": self.__decode_value(line, "turnInfo")}
+        for field in self.fields:
+            frame[field] = self.__decode_value(line, field)
+        if "events" not in frame:
+            events = {}
+            for kind in self.events:
+                value = self.__decode_value(line, kind)
+                events[kind] = value if value is not None else []
+            frame["events"] = events
+        return frame
@@ -1,6 +1,52 @@
+import bisect
+import copy
 import math
 from .unit import GameUnit
+from . import util
 from .util import debug_write
+from .topology import get_topology, iter_bits, popcount
+from .unit_store import UnitStore
+
+
+# The most changes GameMap remembers for _changes_since. Caches older than that are rebuilt
+_CHANGE_LOG_LIMIT = 256
+
+
+class _UnitList(list):
+    """The list of units at one location of a GameMap
+
+    Changing the list directly tells the map, which updates its bitboards, version and undo journal
+    the same way add_unit and remove_unit do.
+    """
+    __slots__ = ("_game_map", "_x", "_y")
+
+    def __init__(self, game_map, x, y, units=()):
+        list.__init__(self, units)
+        self._game_map = game_map
+        self._x = x
+        self._y = y
+
+    def __copy__(self):
+        return list(self)
+
+    def __reduce_ex__(self, protocol):
+        return (_UnitList, (self._game_map, self._x, self._y, list(self)))
+
+
+def _changes_cell(method):
+    def change(self, *args):
+        self._game_map._cell_changing(self)
+        result = method(self, *args)
+        self._game_map._cell_changed(self)
+        return result
+    change.__name__ = method.__name__
+    change.__doc__ = method.__doc__
+    return change
+
+
+for _name in ("append", "extend", "insert", "remove", "pop", "clear", "__setitem__", "__delitem__", "__iadd__", "__imul__"):
+    setattr(_UnitList, _name, _changes_cell(getattr(list, _name)))
+
 
 class GameMap:
     """Holds data about the current game map and provides functions
@@ -9,6 +55,20 @@ class GameMap:
     game_map[x, y] will return a list of Units located at that location, 
     or an empty list if there are no units at the location
 
+    The map also keeps a bitboard of the structures of each player, an int with bit i set
+    when the location with topology index i holds a structure, and one of the locations holding
+    any unit. They are used by pathing, can_spawn, iter_structures and iter_occupied, and are updated
+    by add_unit, remove_unit, assignment to game_map[x, y] and changes to the lists returned by game_map[x, y].
+    The same changes increase version, which lets callers cache results computed from the map.
+
+    fork() makes a copy that shares its columns and units with the original. Each map copies a
+    column the first time it changes it or hands out one of its lists, and copies a unit before
+    upgrading it, so changes to one map do not show up in the other. Lists taken from game_map[x, y]
+    before the fork are still shared, so get them again from the map you want to change.
+
+    While GameState has a savepoint open, the same methods record the previous units of each
+    location they change in an undo journal, which GameState.rollback replays in reverse.
+
     Attributes :
         * config (JSON): Contains information about the current game rules
         * enable_warnings (bool): If true, debug messages for game_map functions will print out
@@ -18,6 +78,8 @@ class GameMap:
         * TOP_LEFT (int): A constant that represents the top left edge
         * BOTTOM_LEFT (int): Hidden challenge! Can you guess what this constant represents???
         * BOTTOM_RIGHT (int): A constant that represents the bottom right edge
+        * topology (:obj: ArenaTopology): Precomputed indices, neighbors and edges of the arena's locations
+        * version (int): Increases every time units are added, removed or upgraded through the map
 
     """
     def __init__(self, config):
@@ -35,48 +97,146 @@ class GameMap:
         self.TOP_LEFT = 1
         self.BOTTOM_LEFT = 2
         self.BOTTOM_RIGHT = 3
+        self.topology = get_topology(self.ARENA_SIZE)
         self.__map = self.__empty_grid()
-        self.__start = [13,0]
+        self.__owned_columns = [True] * self.ARENA_SIZE
+        self.__shared_units = False
+        self.__structures = [0, 0]
+        self.__blocked = 0
+        self.__occupied = 0
+        self.version = 0
+        self.__change_versions = []
+        self.__change_locations = []
+        self.__change_floor = -1
+        self.__hit_radius = None
+        self.__unit_store = None
+        self._journal = None
     
     def __getitem__(self, location):
         if len(location) == 2 and self.in_arena_bounds(location):
             x,y = location
+            if not self.__owned_columns[x]:
+                self.__own_column(x)
             return self.__map[x][y]
         self._invalid_coordinates(location)
 
+    def _units_at(self, x, y):
+        """Gets the units at a location in the arena without copying a column shared with a fork.
+        Used by code that only reads the list, like CoverageMap and UnitStore.
+        """
+        return self.__map[x][y]
+
     def __setitem__(self, location, val):
         if type(location) == tuple and len(location) == 2 and self.in_arena_bounds(location):
-            self.__map[location[0]][location[1]] = val
+            x, y = location
+            self.__column_for_change(x, y)[y] = _UnitList(self, x, y, val)
+            self.__location_changed(location[0], location[1])
+            self.version += 1
             return
         self._invalid_coordinates(location)
 
+    def fork(self):
+        """Makes a copy of the map that shares its unchanged columns and units with this map
+
+        Returns:
+            A new GameMap with the same units. Changes made through the methods of either map do not affect the other
+
+        """
+        child = copy.copy(self)
+        child.__map = list(self.__map)
+        child.__structures = list(self.__structures)
+        child.__owned_columns = [False] * self.ARENA_SIZE
+        child.__shared_units = True
+        child._journal = None
+        child.__change_versions = []
+        child.__change_locations = []
+        child.__change_floor = self.version - 1
+        self.__owned_columns = [False] * self.ARENA_SIZE
+        self.__shared_units = True
+        return child
+
+    def __own_column(self, x):
+        """Copies a column shared with a fork before it is changed, and returns it
+        """
+        if not self.__owned_columns[x]:
+            self.__map[x] = [_UnitList(self, x, y, units) for y, units in enumerate(self.__map[x])]
+            self.__owned_columns[x] = True
+        return self.__map[x]
+
+    def __column_for_change(self, x, y):
+        """Records the units at a location in the undo journal, if it is on, and returns its column ready to be changed
+        """
+        if self._journal is not None:
+            self._journal.append((x, y, list(self.__map[x][y])))
+        return self.__own_column(x)
+
+    def _undo(self, length):
+        """Undoes the changes recorded in the undo journal after its first length entries.
+        Used by GameState.rollback.
+        """
+        while len(self._journal) > length:
+            x, y, units = self._journal.pop()
+            self.__own_column(x)[y] = _UnitList(self, x, y, units)
+            self.__location_changed(x, y)
+        self.version += 1
+
+    def _cell_changing(self, units):
+        """Records a list from game_map[x, y] in the undo journal before it is changed directly
+        """
+        x, y = units._x, units._y
+        if self._journal is not None and self.__map[x][y] is units:
+            self._journal.append((x, y, list(units)))
+
+    def _cell_changed(self, units):
+        """Updates the bitboards and version after a list from game_map[x, y] was changed directly
+        """
+        x, y = units._x, units._y
+        if self.__map[x][y] is units:
+            self.__location_changed(x, y)
+            self.version += 1
+
     def __iter__(self):
-        self.__start = [13,0]
-        return self
-    
-    def __next__(self):
-        location = self.__start
-        if location == [15,27]:
-            raise StopIteration
-        new_location = [location[0]+1, location[1]]
-        while not self.in_arena_bounds(new_location) and not location == [14,27]:
-            if new_location[0] == self.ARENA_SIZE:
-                new_location = [0, new_location[1]+1]
-            else:
-                new_location = [new_location[0]+1, new_location[1]]
-        self.__start = new_location
-        return location 
+        """Iterates over every location in the arena, row by row from the bottom
+
+        Each call gets its own iterator over the topology's locations, so iterations over
+        the same map can be nested.
+        """
+        return map(list, self.topology.index_location)
+
+    def iter_occupied(self):
+        """Iterates over the locations holding at least one unit, in the same order as iterating over the map
+
+        Yields:
+            [x, y] locations
+        """
+        return self.__iter_bitboard(self.__occupied)
+
+    def iter_structures(self, player_index=None):
+        """Iterates over the locations holding a structure, in the same order as iterating over the map
+
+        Args:
+            player_index: 0 for your structures, 1 for the enemy's, or None for the structures of both players
+
+        Yields:
+            [x, y] locations
+        """
+        return self.__iter_bitboard(self.get_structure_bitboard(player_index))
+
+    def __iter_bitboard(self, bitboard):
+        index_location = self.topology.index_location
+        for index in iter_bits(bitboard):
+            yield list(index_location[index])
 
     def __empty_grid(self):
         grid = []
         for x in range(0, self.ARENA_SIZE):
             grid.append([])
-            for _ in range(0, self.ARENA_SIZE):
-                grid[x].append([])
+            for y in range(0, self.ARENA_SIZE):
+                grid[x].append(_UnitList(self, x, y))
         return grid
 
     def _invalid_coordinates(self, location):
-        self.warn("{} is out of bounds.".format(str(location)))
+        self.warn("{} is out of bounds.", location)
 
     def in_arena_bounds(self, location):
         """Checks if the given location is inside the diamond shaped game board.
@@ -88,20 +248,7 @@ class GameMap:
             True if the location is on the board, False otherwise
         
         """
-        x, y = location
-        half_board = self.HALF_ARENA
-
-        row_size = y + 1
-        startx = half_board - row_size
-        endx = startx + (2 * row_size) - 1
-        top_half_check = (y < self.HALF_ARENA and x >= startx and x <= endx)
-
-        row_size = (self.ARENA_SIZE - 1 - y) + 1
-        startx = half_board - row_size
-        endx = startx + (2 * row_size) - 1
-        bottom_half_check = (y >= self.HALF_ARENA and x >= startx and x <= endx)
-
-        return bottom_half_check or top_half_check
+        return self.topology.in_bounds(location)
 
     def get_edge_locations(self, quadrant_description):
         """Takes in an edge description and returns a list of locations.
@@ -114,11 +261,11 @@ class GameMap:
 
         """
         if not quadrant_description in [self.TOP_LEFT, self.TOP_RIGHT, self.BOTTOM_LEFT, self.BOTTOM_RIGHT]:
-            self.warn("Passed invalid quadrant_description '{}'. See the documentation for valid inputs for get_edge_locations.".format(quadrant_description))
+            self.warn("Passed invalid quadrant_description '{}'. See the documentation for valid inputs for get_edge_locations.", quadrant_description)
             return
 
-        edges = self.get_edges()
-        return edges[quadrant_description]
+        index_location = self.topology.index_location
+        return [list(index_location[index]) for index in self.topology.edges[quadrant_description]]
 
     def get_edges(self):
         """Gets all of the edges and their edge locations
@@ -127,35 +274,17 @@ class GameMap:
             A list with four lists inside of it of locations corresponding to the four edges.
             [0] = top_right, [1] = top_left, [2] = bottom_left, [3] = bottom_right.
         """
-        top_right = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA + num
-            y = self.ARENA_SIZE - 1 - num
-            top_right.append([int(x), int(y)])
-        top_left = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA - 1 - num
-            y = self.ARENA_SIZE - 1 - num
-            top_left.append([int(x), int(y)])
-        bottom_left = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA - 1 - num
-            y = num
-            bottom_left.append([int(x), int(y)])
-        bottom_right = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA + num
-            y = num
-            bottom_right.append([int(x), int(y)])
-        return [top_right, top_left, bottom_left, bottom_right]
+        index_location = self.topology.index_location
+        return [[list(index_location[index]) for index in edge] for edge in self.topology.edges]
     
-    def add_unit(self, unit_type, location, player_index=0):
+    def add_unit(self, unit_type, location, player_index=0, num=1):
         """Add a single GameUnit to the map at the given location.
 
         Args:
             unit_type: The type of the new unit. Use the constants provided in algo_strategy.
             location: A list of two integers representing the [x,y] coordinate of the new unit
             player_index: The index corresponding to the player controlling the new unit, 0 for you 1 for the enemy
+            num: The number of mobile units to add at once. Structures do not stack, so only one is ever added
 
         This function does not affect your turn and only changes the data stored in GameMap. The intended use of this function
         is to allow you to create arbitrary gamestates. Using this function on the game_map provided with game_state will 
@@ -164,14 +293,43 @@ class GameMap:
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
         if player_index < 0 or player_index > 1:
-            self.warn("Player index {} is invalid. Player index should be 0 or 1.".format(player_index))
+            self.warn("Player index {} is invalid. Player index should be 0 or 1.", player_index)
 
         x, y = location
         new_unit = GameUnit(unit_type, self.config, player_index, None, location[0], location[1])
         if not new_unit.stationary:
-            self.__map[x][y].append(new_unit)
+            units = self.__column_for_change(x, y)[y]
+            list.append(units, new_unit)
+            for _ in range(num - 1):
+                list.append(units, GameUnit(unit_type, self.config, player_index, None, location[0], location[1]))
         else:
-            self.__map[x][y] = [new_unit]
+            self.__column_for_change(x, y)[y] = _UnitList(self, x, y, [new_unit])
+        self.__location_changed(x, y)
+        self.version += 1
+
+    def _place_unit(self, unit):
+        """Adds an existing GameUnit to the units at its location, without replacing any of them.
+        Used when parsing the game state.
+        """
+        list.append(self.__column_for_change(unit.x, unit.y)[unit.y], unit)
+        self.__location_changed(unit.x, unit.y)
+        self.version += 1
+
+    def _upgrade_unit(self, unit):
+        """Upgrades a GameUnit that is on the map.
+        Used when parsing the game state and by GameState.attempt_upgrade.
+        If the unit may be shared with a fork or the undo journal, it is replaced by an upgraded copy.
+        """
+        if self.__shared_units or self._journal is not None:
+            units = self.__column_for_change(unit.x, unit.y)[unit.y]
+            for i, existing_unit in enumerate(units):
+                if existing_unit is unit:
+                    unit = copy.copy(unit)
+                    list.__setitem__(units, i, unit)
+                    break
+        unit.upgrade()
+        self.__location_changed(unit.x, unit.y)
+        self.version += 1
 
     def remove_unit(self, location):
         """Remove all units on the map in the given location.
@@ -186,7 +344,130 @@ class GameMap:
             self._invalid_coordinates(location)
         
         x, y = location
-        self.__map[x][y] = []
+        self.__column_for_change(x, y)[y] = _UnitList(self, x, y)
+        self.__location_changed(x, y)
+        self.version += 1
+
+    def __location_changed(self, x, y):
+        """Updates the bitboards after the units at a location changed, and records the location in the change log
+        """
+        self.__update_bitboards(x, y)
+        if self.topology.location_index[x][y] == -1:
+            return
+        self.__change_versions.append(self.version)
+        self.__change_locations.append((x, y))
+        if len(self.__change_versions) > _CHANGE_LOG_LIMIT:
+            dropped = len(self.__change_versions) // 2
+            self.__change_floor = self.__change_versions[dropped - 1]
+            del self.__change_versions[:dropped]
+            del self.__change_locations[:dropped]
+
+    def _changes_since(self, version):
+        """Gets the locations whose units changed since the map had a given version.
+        Used by CoverageMap to update itself instead of being rebuilt.
+
+        Returns:
+            A list of (x, y) tuples, which may repeat, or None if the change log no longer goes back that far
+        """
+        if version <= self.__change_floor:
+            return None
+        return self.__change_locations[bisect.bisect_left(self.__change_versions, version):]
+
+    def __update_bitboards(self, x, y):
+        index = self.topology.location_index[x][y]
+        if index == -1:
+            return
+        bit = 1 << index
+        units = self.__map[x][y]
+        if units:
+            self.__occupied |= bit
+        else:
+            self.__occupied &= ~bit
+        for player_index in (0, 1):
+            if any(unit.stationary and unit.player_index == player_index for unit in units):
+                self.__structures[player_index] |= bit
+            else:
+                self.__structures[player_index] &= ~bit
+        if any(unit.stationary for unit in units):
+            self.__blocked |= bit
+        else:
+            self.__blocked &= ~bit
+
+    def get_structure_bitboard(self, player_index=None):
+        """Gets the bitboard of the locations holding structures
+
+        Args:
+            player_index: 0 for your structures, 1 for the enemy's, or None for the structures of both players
+
+        Returns:
+            An int with bit i set when the location with topology index i holds a structure
+
+        """
+        if player_index is None:
+            return self.__blocked
+        return self.__structures[player_index]
+
+    def get_occupied_bitboard(self):
+        """Gets the bitboard of the locations holding units
+
+        Returns:
+            An int with bit i set when the location with topology index i holds at least one unit
+
+        """
+        return self.__occupied
+
+    def is_blocked(self, location):
+        """Checks if a location holds a structure of either player
+
+        Args:
+            location: A map location
+
+        Returns:
+            True if there is a structure at the location, False otherwise
+
+        """
+        index = self.topology.index(location)
+        return index != -1 and (self.__blocked >> index) & 1 == 1
+
+    def count_structures(self, player_index=None):
+        """Counts the structures on the map
+
+        Args:
+            player_index: 0 for your structures, 1 for the enemy's, or None for the structures of both players
+
+        Returns:
+            The number of locations holding a structure
+
+        """
+        return popcount(self.get_structure_bitboard(player_index))
+
+    def get_unit_store(self):
+        """Gets the units on the map as parallel numpy arrays, for queries over every unit at once
+
+        The store is cached and rebuilt when the map's version changes. Requires numpy.
+
+        Returns:
+            A UnitStore of the units on the map
+
+        """
+        store = self.__unit_store
+        if store is None or store.version != self.version or store.game_map is not self:
+            store = UnitStore(self)
+            self.__unit_store = store
+        return store
+
+    def bitboard_locations(self, bitboard):
+        """Gets the locations whose bits are set in a bitboard
+
+        Args:
+            bitboard: A bitboard, for example the union of get_structure_bitboard(0) and get_structure_bitboard(1)
+
+        Returns:
+            A list of [x, y] locations, in topology index order
+
+        """
+        index_location = self.topology.index_location
+        return [list(index_location[index]) for index in iter_bits(bitboard)]
 
     def get_locations_in_range(self, location, radius):
         """Gets locations in a circular area around a location
@@ -200,14 +481,77 @@ class GameMap:
 
         """
         if radius < 0 or radius > self.ARENA_SIZE:
-            self.warn("Radius {} was passed to get_locations_in_range. Expected integer between 0 and {}".format(radius, self.ARENA_SIZE))
+            self.warn("Radius {} was passed to get_locations_in_range. Expected integer between 0 and {}", radius, self.ARENA_SIZE)
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
+            return self.__scan_locations_in_range(location, radius)
+        return self.get_locations_in_range_unchecked(location, radius)
+
+    def get_locations_in_range_unchecked(self, location, radius):
+        """Gets locations in a circular area around a location, without checking the arguments
 
+        Like get_locations_in_range, for inner loops that already know the location is in the arena.
+
+        Args:
+            location: The center of our search area, which must be in the arena
+            radius: The radius of our search area
+
+        Returns:
+            The locations that are within our search area
+
+        """
+        index_location = self.topology.index_location
+        return [list(index_location[index]) for index in self.topology.indices_in_range(self.topology.index(location), radius, self.__get_hit_radius())]
+
+    def get_location_indices_in_range(self, location, radius):
+        """Gets the topology indices of the locations in a circular area around a location
+
+        Unlike get_locations_in_range, the result is shared between calls and must not be modified.
+
+        Args:
+            location: The center of our search area
+            radius: The radius of our search area
+
+        Returns:
+            A tuple of the indices of the locations within our search area, in the same order as get_locations_in_range
+
+        """
+        if not self.in_arena_bounds(location):
+            return tuple(self.topology.index(in_range) for in_range in self.get_locations_in_range(location, radius))
+        return self.topology.indices_in_range(self.topology.index(location), radius, self.__get_hit_radius())
+
+    def get_range_mask(self, location, radius):
+        """Gets the locations in a circular area around a location as a bitboard
+
+        The mask can be combined with get_structure_bitboard, for example
+        popcount(game_map.get_range_mask(location, radius) & game_map.get_structure_bitboard(1))
+        counts the enemy structures in range.
+
+        Args:
+            location: The center of our search area
+            radius: The radius of our search area
+
+        Returns:
+            An int with the bit of every location within our search area set
+
+        """
+        if not self.in_arena_bounds(location):
+            mask = 0
+            for index in self.get_location_indices_in_range(location, radius):
+                mask |= 1 << index
+            return mask
+        return self.topology.range_mask(self.topology.index(location), radius, self.__get_hit_radius())
+
+    def __get_hit_radius(self):
+        if self.__hit_radius is None:
+            self.__hit_radius = self.config["unitInformation"][0]['getHitRadius']
+        return self.__hit_radius
+
+    def __scan_locations_in_range(self, location, radius):
         x, y = location
         locations = []
         search_radius = math.ceil(radius)
-        getHitRadius = self.config["unitInformation"][0]['getHitRadius']
+        getHitRadius = self.__get_hit_radius()
         for i in range(int(x - search_radius), int(x + search_radius + 1)):
             for j in range(int(y - search_radius), int(y + search_radius + 1)):
                 new_location = [i, j]
@@ -232,9 +576,10 @@ class GameMap:
 
         return math.sqrt((x1 - x2)**2 + (y1 - y2)**2)
 
-    def warn(self, message):
+    def warn(self, message, *args):
         """
-        Used internally by game_map to print out default messaging
+        Used internally by game_map to print out default messaging.
+        The message is only formatted with args if the warning is printed.
         """
-        if(self.enable_warnings):
-            debug_write(message)
+        if self.enable_warnings and util.log_level >= util.LOG_WARNINGS:
+            debug_write(message.format(*args) if args else message)
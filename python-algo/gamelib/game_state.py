@@ -1,11 +1,27 @@
+import copy
 import math
 import json
 import sys
+from contextlib import contextmanager
 
 from .navigation import ShortestPathFinder
+from . import util
 from .util import send_command, debug_write
 from .unit import GameUnit
 from .game_map import GameMap
+from .coverage import CoverageMap
+from .targeting import TargetIndex
+from .unit_types import get_unit_type_registry
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SP = 0
+MP = 1
+_unit_types = None
+_location_index_arrays = {}
 
 def is_stationary(unit_type):
     """
@@ -15,7 +31,39 @@ def is_stationary(unit_type):
         Returns: 
             Boolean, True if the unit is stationary, False otherwise.
     """
-    return unit_type in STRUCTURE_TYPES
+    return _unit_types.is_stationary(unit_type)
+
+def _use_unit_types(unit_types):
+    """
+    Points the module level unit type constants at a UnitTypeRegistry. They are only rebound when the config changes.
+    """
+    global _unit_types, WALL, FACTORY, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, REMOVE, UPGRADE, STRUCTURE_TYPES, ALL_UNITS, UNIT_TYPE_TO_INDEX
+    if _unit_types is unit_types:
+        return
+    _unit_types = unit_types
+    WALL, FACTORY, TURRET = unit_types.WALL, unit_types.FACTORY, unit_types.TURRET
+    SCOUT, DEMOLISHER, INTERCEPTOR = unit_types.SCOUT, unit_types.DEMOLISHER, unit_types.INTERCEPTOR
+    REMOVE, UPGRADE = unit_types.REMOVE, unit_types.UPGRADE
+    STRUCTURE_TYPES = unit_types.STRUCTURE_TYPES
+    ALL_UNITS = unit_types.ALL_UNITS
+    UNIT_TYPE_TO_INDEX = unit_types.UNIT_TYPE_TO_INDEX
+
+def _bitboard_array(bitboard, size):
+    """
+    Unpacks the first size bits of a bitboard into a numpy boolean array.
+    """
+    packed = np.frombuffer(bitboard.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder="little")[:size].astype(bool)
+
+def _location_index_array(topology):
+    """
+    Gets topology.location_index as a numpy array, building it once per arena size.
+    """
+    array = _location_index_arrays.get(topology.ARENA_SIZE)
+    if array is None:
+        array = np.array(topology.location_index, dtype=np.intp)
+        _location_index_arrays[topology.ARENA_SIZE] = array
+    return array
 
 class GameState:
     """Represents the entire gamestate for a given turn
@@ -32,78 +80,99 @@ class GameState:
         * REMOVE (str): A constant representing removing your own unit
         * UPGRADE (str): A constant representing upgrading a unit
         * STRUCTURE_TYPES (list): A list of the structure units
+        * unit_types (:obj: UnitTypeRegistry): The unit types of the config, shared by every GameState with the same config
 
         * ARENA_SIZE (int): The size of the arena
         * HALF_ARENA (int): Half the size of the arena
         * MP (int): A constant representing the Mobile Points resource, used in the get_resource function
         * SP (int): A constant representing the SP resource, used in the get_resource function
          
-        * game_map (:obj: GameMap): The current GameMap. To retrieve a list of GameUnits at a location, use game_map[x, y]
+        * game_map (:obj: GameMap): The current GameMap. To retrieve a list of GameUnits at a location, use game_map[x, y]. In lazy mode, it is filled in the first time it is used
         * turn_number (int): The current turn number. Starts at 0.
         * my_health (int): Your current remaining health
         * my_time (int): The time you took to submit your previous turn
         * enemy_health (int): Your opponents current remaining health
         * enemy_time (int): Your opponents current remaining time
+        * turn_budget (:obj: TurnBudget): If set, submit_turn goes through it so only the first submitted turn is sent.
+          Pass AlgoCore.turn_budget when building the GameState in on_turn, so a turn already submitted by the watchdog is not sent twice
 
     """
 
-    def __init__(self, config, serialized_string):
+    def __init__(self, config, serialized_string, lazy=False, turn_budget=None):
         """ Setup a turns variables using arguments passed
 
         Args:
             * config (JSON): A json object containing information about the game
-            * serialized_string (string): A string containing information about the game state at the start of this turn
+            * serialized_string (string): A string containing information about the game state at the start of this turn.
+              The dict decoded from that string is also accepted, which avoids decoding it again
+            * lazy (bool): If true, the units are only added to game_map the first time it is used.
+              Turn number, health and resources are always available right away.
+            * turn_budget (:obj: TurnBudget): The budget submit_turn goes through, usually AlgoCore.turn_budget. None sends directly
 
         """
-        self.serialized_string = serialized_string
+        self.serialized_string = serialized_string if isinstance(serialized_string, str) else None
         self.config = config
         self.enable_warnings = True
+        self.turn_budget = turn_budget
+        self._forked = False
 
-        global WALL, FACTORY, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, REMOVE, UPGRADE, STRUCTURE_TYPES, ALL_UNITS, UNIT_TYPE_TO_INDEX
-        UNIT_TYPE_TO_INDEX = {}
-        WALL = config["unitInformation"][0]["shorthand"]
-        UNIT_TYPE_TO_INDEX[WALL] = 0
-        FACTORY = config["unitInformation"][1]["shorthand"]
-        UNIT_TYPE_TO_INDEX[FACTORY] = 1
-        TURRET = config["unitInformation"][2]["shorthand"]
-        UNIT_TYPE_TO_INDEX[TURRET] = 2
-        SCOUT = config["unitInformation"][3]["shorthand"]
-        UNIT_TYPE_TO_INDEX[SCOUT] = 3
-        DEMOLISHER = config["unitInformation"][4]["shorthand"]
-        UNIT_TYPE_TO_INDEX[DEMOLISHER] = 4
-        INTERCEPTOR = config["unitInformation"][5]["shorthand"]
-        UNIT_TYPE_TO_INDEX[INTERCEPTOR] = 5
-        REMOVE = config["unitInformation"][6]["shorthand"]
-        UNIT_TYPE_TO_INDEX[REMOVE] = 6
-        UPGRADE = config["unitInformation"][7]["shorthand"]
-        UNIT_TYPE_TO_INDEX[UPGRADE] = 7
-
-        ALL_UNITS = [SCOUT, DEMOLISHER, INTERCEPTOR, WALL, FACTORY, TURRET]
-        STRUCTURE_TYPES = [WALL, FACTORY, TURRET]
+        self.unit_types = get_unit_type_registry(config)
+        _use_unit_types(self.unit_types)
 
         self.ARENA_SIZE = 28
         self.HALF_ARENA = int(self.ARENA_SIZE / 2)
-        self.MP = 1
-        self.SP = 0
-        global MP, SP
-        MP = self.MP
-        SP = self.SP
+        self.MP = MP
+        self.SP = SP
 
+        self._pending_units = None
         self.game_map = GameMap(self.config)
         self._shortest_path_finder = ShortestPathFinder()
+        self._coverage_maps = [None, None]
+        self._target_index = None
+        self._journal = None
+        self._savepoints = 0
         self._build_stack = []
         self._deploy_stack = []
         self._player_resources = [
                 {'SP': 0, 'MP': 0},  # player 0, which is you
                 {'SP': 0, 'MP': 0}]  # player 1, which is the opponent
         self.__parse_state(serialized_string)
+        if not lazy:
+            self.__load_units()
+
+    @classmethod
+    def from_parsed(cls, config, state, lazy=False, turn_budget=None):
+        """Creates a GameState from a game state message that has already been decoded
+
+        Args:
+            * config (JSON): A json object containing information about the game
+            * state (dict): The decoded game state message, such as the one AlgoCore passes to on_turn when decoded_messages is true
+            * lazy (bool): If true, the units are only added to game_map the first time it is used
+            * turn_budget (:obj: TurnBudget): The budget submit_turn goes through, usually AlgoCore.turn_budget
+
+        Returns:
+            The GameState for the message
+
+        """
+        return cls(config, state, lazy, turn_budget)
+
+    @property
+    def game_map(self):
+        if self._pending_units is not None:
+            self.__load_units()
+        return self._game_map
+
+    @game_map.setter
+    def game_map(self, game_map):
+        self._game_map = game_map
+        self._pending_units = None
 
     def __parse_state(self, state_line):
         """
-        Fills in map based on the serialized game state so that self.game_map[x,y] is a list of GameUnits at that location.
-        state_line is the game state as a json string.
+        Reads the turn number, health and resources from the serialized game state, and keeps the units
+        until __load_units adds them to the map. state_line is the game state as a json string or decoded dict.
         """
-        state = json.loads(state_line)
+        state = json.loads(state_line) if isinstance(state_line, str) else state_line
 
         turn_info = state["turnInfo"]
         self.turn_number = int(turn_info[1])
@@ -120,8 +189,14 @@ class GameState:
             {'SP': p1_SP, 'MP': p1_MP},
             {'SP': p2_SP, 'MP': p2_MP}]
 
-        p1units = state["p1Units"]
-        p2units = state["p2Units"]
+        self._pending_units = (state["p1Units"], state["p2Units"])
+
+    def __load_units(self):
+        """
+        Fills in map based on the parsed game state so that self.game_map[x,y] is a list of GameUnits at that location.
+        """
+        p1units, p2units = self._pending_units
+        self._pending_units = None
 
         self.__create_parsed_units(p1units, 0)
         self.__create_parsed_units(p2units, 1)
@@ -130,27 +205,27 @@ class GameState:
         """
         Helper function for __parse_state to add units to the map.
         """
-        typedef = self.config.get("unitInformation")
+        types = self.unit_types.types
         for i, unit_types in enumerate(units):
             for uinfo in unit_types:
-                unit_type = typedef[i].get("shorthand")
+                unit_type = types[i]
                 sx, sy, shp = uinfo[:3]
                 x, y = map(int, [sx, sy])
                 hp = float(shp)
                 # This depends on RM and UP always being the last types to be processed
-                if unit_type == REMOVE:
+                if unit_type == self.unit_types.REMOVE:
                     # Quick fix will deploy engine fix soon
                     if self.contains_stationary_unit([x,y]):
                         self.game_map[x,y][0].pending_removal = True
-                elif unit_type == UPGRADE:
+                elif unit_type == self.unit_types.UPGRADE:
                     if self.contains_stationary_unit([x,y]):
-                        self.game_map[x,y][0].upgrade()
+                        self.game_map._upgrade_unit(self.game_map[x,y][0])
                 else:
-                    unit = GameUnit(unit_type, self.config, player_number, hp, x, y)
-                    self.game_map[x,y].append(unit)
+                    unit = GameUnit(unit_type, self.config, player_number, hp, x, y, uinfo[3] if len(uinfo) > 3 else None)
+                    self.game_map._place_unit(unit)
 
     def __resource_required(self, unit_type):
-        return self.SP if is_stationary(unit_type) else self.MP
+        return self.SP if self.unit_types.is_stationary(unit_type) else self.MP
 
     def __set_resource(self, resource_type, amount, player_index=0):
         """
@@ -163,18 +238,130 @@ class GameState:
         elif resource_type == self.SP:
             resource_key = 'SP'
         held_resource = self.get_resource(resource_type, player_index)
+        if self._journal is not None:
+            self._journal.append((player_index, resource_key, self._player_resources[player_index][resource_key]))
         self._player_resources[player_index][resource_key] = held_resource + amount
 
     def _invalid_player_index(self, index):
-        self.warn("Invalid player index {} passed, player index should always be 0 (yourself) or 1 (your opponent)".format(index))
+        self.warn("Invalid player index {} passed, player index should always be 0 (yourself) or 1 (your opponent)", index)
     
     def _invalid_unit(self, unit):
-        self.warn("Invalid unit {}".format(unit))
+        self.warn("Invalid unit {}", unit)
+
+    def fork(self):
+        """Makes a copy of this GameState to try out hypothetical moves on
+
+        The copy shares the config, its pathfinder and the unchanged parts of game_map with this state,
+        so it is cheap to make. Spawning, removing and upgrading units in either state, through
+        attempt_spawn, attempt_upgrade or the methods of game_map, does not affect the other.
+        A fork is only for trying moves out, so its submit_turn does nothing.
+
+        Returns:
+            A new GameState with the same map, resources and planned turn as this one
+
+        """
+        child = copy.copy(self)
+        child.turn_budget = None
+        child._forked = True
+        child.game_map = self.game_map.fork()
+        child._coverage_maps = [None, None]
+        child._target_index = None
+        child._journal = None
+        child._savepoints = 0
+        child._build_stack = list(self._build_stack)
+        child._deploy_stack = list(self._deploy_stack)
+        child._player_resources = [dict(resources) for resources in self._player_resources]
+        return child
+
+    def savepoint(self):
+        """Starts recording changes so they can be undone with rollback
+
+        While a savepoint is open, changes to resources, the planned turn and game_map made by
+        attempt_spawn, attempt_remove, attempt_upgrade or the methods of game_map are logged in
+        an undo journal. Savepoints can be nested. Close each one with release when it is no longer needed.
+
+        Returns:
+            A savepoint to pass to rollback and release
+
+        """
+        if self._journal is None:
+            self._journal = []
+            self.game_map._journal = []
+        self._savepoints += 1
+        return (len(self._journal), len(self.game_map._journal), len(self._build_stack), len(self._deploy_stack))
+
+    def rollback(self, savepoint):
+        """Undoes every change made since a savepoint. The savepoint stays open and can be rolled back to again
+
+        This takes time proportional to the number of changes, not the size of the game state.
+
+        Args:
+            savepoint: A savepoint returned by savepoint
+
+        """
+        if self._journal is None:
+            self.warn("Could not roll back, there is no open savepoint.")
+            return
+        resources_length, map_length, build_length, deploy_length = savepoint
+        while len(self._journal) > resources_length:
+            player_index, resource_key, amount = self._journal.pop()
+            self._player_resources[player_index][resource_key] = amount
+        self.game_map._undo(map_length)
+        del self._build_stack[build_length:]
+        del self._deploy_stack[deploy_length:]
+
+    def release(self, savepoint):
+        """Closes a savepoint, keeping its changes. Recording stops when the last open savepoint is released
+
+        Args:
+            savepoint: A savepoint returned by savepoint
+
+        """
+        if self._savepoints == 0:
+            self.warn("Could not release savepoint, there is no open savepoint.")
+            return
+        self._savepoints -= 1
+        if self._savepoints == 0:
+            self._journal = None
+            self.game_map._journal = None
+
+    @contextmanager
+    def transaction(self):
+        """Opens a savepoint for the duration of a with block
+
+        The changes are kept when the block finishes, and undone if it raises an exception.
+        Call rollback with the savepoint to undo them early, for example to try out a placement:
+
+            with game_state.transaction() as savepoint:
+                game_state.attempt_spawn(TURRET, [13, 5])
+                score = evaluate(game_state)
+                game_state.rollback(savepoint)
+
+        Returns:
+            The savepoint, for use with rollback
+
+        """
+        savepoint = self.savepoint()
+        try:
+            yield savepoint
+        except BaseException:
+            self.rollback(savepoint)
+            raise
+        finally:
+            self.release(savepoint)
 
     def submit_turn(self):
         """Submit and end your turn.
             Must be called at the end of your turn or the algo will hang.
+            If turn_budget is set, nothing is sent if it has already submitted a turn.
+            Forks can not submit a turn.
         """
+        if self._forked:
+            self.warn("Can not submit the turn of a forked GameState. Replay its moves on the original GameState instead.")
+            return
+        if self.turn_budget is not None:
+            self.turn_budget.submit(self)
+            return
         build_string = json.dumps(self._build_stack)
         deploy_string = json.dumps(self._deploy_stack)
         send_command(build_string)
@@ -195,7 +382,7 @@ class GameState:
             self._invalid_player_index(player_index)
             return
         if not resource_type == self.MP and not resource_type == self.SP:
-            self.warn("Invalid resource_type '{}'. Please use MP (0) or SP (1)".format(resource_type))
+            self.warn("Invalid resource_type '{}'. Please use MP (0) or SP (1)", resource_type)
             return
 
         if resource_type == self.MP:
@@ -234,7 +421,7 @@ class GameState:
             The number of units affordable of the given unit_type.
 
         """
-        if unit_type not in ALL_UNITS:
+        if not self.unit_types.is_unit(unit_type):
             self._invalid_unit(unit_type)
             return
 
@@ -264,11 +451,11 @@ class GameState:
         """
 
         if turns_in_future < 1 or turns_in_future > 99:
-            self.warn("Invalid turns in future used ({}). Turns in future should be between 1 and 99".format(turns_in_future))
+            self.warn("Invalid turns in future used ({}). Turns in future should be between 1 and 99", turns_in_future)
         if not player_index == 1 and not player_index == 0:
             self._invalid_player_index(player_index)
         if type(current_MP) == int and current_MP < 0:
-            self.warn("Invalid current MP ({}). Current MP cannot be negative.".format(current_MP))
+            self.warn("Invalid current MP ({}). Current MP cannot be negative.", current_MP)
 
         MP = self.get_resource(self.MP, player_index) if not current_MP else current_MP
         for increment in range(1, turns_in_future + 1):
@@ -282,6 +469,42 @@ class GameState:
             MP = round(MP, 1)
         return MP
 
+    def project_future_SP(self, turns_in_future=1, player_index=0, current_SP=None):
+        """Predicts the number of SP we will have on a future turn
+
+        Each turn adds the SP every player gets per round, and the SP generated by each of the
+        player's structures that is not pending removal. Structures built or destroyed later are not accounted for.
+
+        Args:
+            turns_in_future: The number of turns in the future we want to look forward to predict
+            player_index: The player whose SP we are tracking
+            current_SP: If we pass a value here, we will use that value instead of the current SP of the given player.
+
+        Returns:
+            The number of SP the given player will have after the given number of turns
+
+        """
+
+        if turns_in_future < 1 or turns_in_future > 99:
+            self.warn("Invalid turns in future used ({}). Turns in future should be between 1 and 99", turns_in_future)
+        if not player_index == 1 and not player_index == 0:
+            self._invalid_player_index(player_index)
+        if type(current_SP) == int and current_SP < 0:
+            self.warn("Invalid current SP ({}). Current SP cannot be negative.", current_SP)
+
+        SP_per_round = self.config["resources"]["coresPerRound"]
+        for location in self.game_map.iter_structures(player_index):
+            for unit in self.game_map[location]:
+                if unit.stationary and not unit.pending_removal:
+                    type_config = self.unit_types.templates[unit.unit_type][0]
+                    generated = type_config.get("generatesResource1", 0)
+                    if unit.upgraded:
+                        generated = type_config.get("upgrade", {}).get("generatesResource1", generated)
+                    SP_per_round += generated
+
+        SP = self.get_resource(self.SP, player_index) if current_SP is None else current_SP
+        return round(SP + SP_per_round * turns_in_future, 1)
+
     def type_cost(self, unit_type, upgrade=False):
         """Gets the cost of a unit based on its type
 
@@ -292,16 +515,11 @@ class GameState:
             The units costs as a list [SP, MP]
 
         """
-        if unit_type == REMOVE:
+        if unit_type == self.unit_types.REMOVE:
             self._invalid_unit(unit_type)
             return
-        
-        unit_def = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[unit_type]]
-        cost_base = [unit_def.get('cost1', 0), unit_def.get('cost2', 0)]
-        if upgrade:
-            return [unit_def.get('upgrade', {}).get('cost1', cost_base[SP]), unit_def.get('upgrade', {}).get('cost2', cost_base[MP])]
 
-        return cost_base
+        return self.unit_types.cost(unit_type, upgrade)
 
 
     def can_spawn(self, unit_type, location, num=1):
@@ -320,22 +538,28 @@ class GameState:
             True if we can spawn the unit(s)
 
         """
-        if unit_type not in ALL_UNITS:
+        if not self.unit_types.is_unit(unit_type):
             self._invalid_unit(unit_type)
             return
         
-        if not self.game_map.in_arena_bounds(location):
-            if self.enable_warnings:
-                self.warn("Could not spawn {} at location {}. Location invalid.".format(unit_type, location))
+        topology = self.game_map.topology
+        index = topology.index(location)
+        if index < 0:
+            if self._warnings_enabled():
+                self.warn("Could not spawn {} at location {}. Location invalid.", unit_type, location)
             return False
 
         affordable = self.number_affordable(unit_type) >= num
-        stationary = is_stationary(unit_type)
-        blocked = self.contains_stationary_unit(location) or (stationary and len(self.game_map[location[0],location[1]]) > 0)
-        correct_territory = location[1] < self.HALF_ARENA
-        on_edge = location in (self.game_map.get_edge_locations(self.game_map.BOTTOM_LEFT) + self.game_map.get_edge_locations(self.game_map.BOTTOM_RIGHT))
+        stationary = self.unit_types.is_stationary(unit_type)
+        # Structures need an empty location, mobile units only need one without a structure
+        if stationary:
+            blocked = (self.game_map.get_occupied_bitboard() >> index) & 1 == 1
+        else:
+            blocked = (self.game_map.get_structure_bitboard() >> index) & 1 == 1
+        correct_territory = (topology.territory_masks[0] >> index) & 1 == 1
+        on_edge = (topology.spawn_masks[0] >> index) & 1 == 1
 
-        if self.enable_warnings:
+        if self._warnings_enabled():
             fail_reason = ""
             if not affordable:
                 fail_reason = fail_reason + " Not enough resources."
@@ -346,12 +570,47 @@ class GameState:
             if not (stationary or on_edge):
                 fail_reason = fail_reason + " Information units must be deployed on the edge."
             if len(fail_reason) > 0:
-                self.warn("Could not spawn {} at location {}.{}".format(unit_type, location, fail_reason))
+                self.warn("Could not spawn {} at location {}.{}", unit_type, location, fail_reason)
 
         return (affordable and correct_territory and not blocked and
                 (stationary or on_edge) and
                 (not stationary or num == 1))
 
+    def can_spawn_many(self, unit_type, locations):
+        """Checks if one unit of a type could be spawned at each of many locations, without printing warnings
+
+        Each location is checked on its own, as if can_spawn(unit_type, location) was called
+        for it with nothing else spawned. Requires numpy.
+
+        Args:
+            unit_type: The type of the unit
+            locations: A list of locations, or an array with one [x, y] row per location
+
+        Returns:
+            A numpy boolean array, True for each location the unit could be spawned at
+
+        """
+        if np is None:
+            raise ImportError("can_spawn_many requires numpy. Use can_spawn instead.")
+        if not self.unit_types.is_unit(unit_type):
+            self._invalid_unit(unit_type)
+            return
+
+        topology = self.game_map.topology
+        coordinates = np.asarray(locations, dtype=float).reshape(-1, 2)
+        x, y = coordinates[:, 0], coordinates[:, 1]
+        inside = (x == np.floor(x)) & (y == np.floor(y)) & (x >= 0) & (x < topology.ARENA_SIZE) & (y >= 0) & (y < topology.ARENA_SIZE)
+        indices = _location_index_array(topology)[np.where(inside, x, 0).astype(np.intp), np.where(inside, y, 0).astype(np.intp)]
+        inside &= indices >= 0
+        if self.number_affordable(unit_type) < 1:
+            return np.zeros(len(indices), dtype=bool)
+
+        if self.unit_types.is_stationary(unit_type):
+            legal = topology.territory_masks[0] & ~self.game_map.get_occupied_bitboard()
+        else:
+            legal = topology.spawn_masks[0] & ~self.game_map.get_structure_bitboard()
+        return inside & _bitboard_array(legal, topology.size)[np.where(inside, indices, 0)]
+
     def attempt_spawn(self, unit_type, locations, num=1):
         """Attempts to spawn new units with the type given in the given locations.
 
@@ -364,31 +623,35 @@ class GameState:
             The number of units successfully spawned
 
         """
-        if unit_type not in ALL_UNITS:
+        if not self.unit_types.is_unit(unit_type):
             self._invalid_unit(unit_type)
             return
         if num < 1:
-            self.warn("Attempted to spawn fewer than one units! ({})".format(num))
+            self.warn("Attempted to spawn fewer than one units! ({})", num)
             return
       
         if type(locations[0]) == int:
             locations = [locations]
+        stationary = self.unit_types.is_stationary(unit_type)
+        costs = self.type_cost(unit_type)
         spawned_units = 0
         for location in locations:
-            for i in range(num):
-                if self.can_spawn(unit_type, location, 1):
-                    x, y = map(int, location)
-                    costs = self.type_cost(unit_type)
-                    self.__set_resource(SP, 0 - costs[SP])
-                    self.__set_resource(MP, 0 - costs[MP])
-                    self.game_map.add_unit(unit_type, location, 0)
-                    if is_stationary(unit_type):
-                        self._build_stack.append((unit_type, x, y))
-                    else:
-                        self._deploy_stack.append((unit_type, x, y))
-                    spawned_units += 1
-                else:
-                    break
+            if not self.can_spawn(unit_type, location, 1):
+                continue
+            # Once one unit fits, the location stays legal for more mobile units until the resources run out
+            number = 1 if stationary else min(num, self.number_affordable(unit_type))
+            x, y = map(int, location)
+            self.__set_resource(SP, 0 - costs[SP] * number)
+            self.__set_resource(MP, 0 - costs[MP] * number)
+            self.game_map.add_unit(unit_type, location, 0, number)
+            if stationary:
+                self._build_stack.append((unit_type, x, y))
+            else:
+                self._deploy_stack.extend([(unit_type, x, y)] * number)
+            spawned_units += number
+            if number < num and self._warnings_enabled():
+                # Prints the reason the next unit could not be spawned
+                self.can_spawn(unit_type, location, 1)
         return spawned_units
 
     def attempt_remove(self, locations):
@@ -407,10 +670,10 @@ class GameState:
         for location in locations:
             if location[1] < self.HALF_ARENA and self.contains_stationary_unit(location):
                 x, y = map(int, location)
-                self._build_stack.append((REMOVE, x, y))
+                self._build_stack.append((self.unit_types.REMOVE, x, y))
                 removed_units += 1
             else:
-                self.warn("Could not remove a unit from {}. Location has no structures or is enemy territory.".format(location))
+                self.warn("Could not remove a unit from {}. Location has no structures or is enemy territory.", location)
         return removed_units
 
     def attempt_upgrade(self, locations):
@@ -435,17 +698,17 @@ class GameState:
                     if unit.stationary:
                         existing_unit = unit
 
-                if not existing_unit.upgraded and self.config["unitInformation"][UNIT_TYPE_TO_INDEX[existing_unit.unit_type]].get("upgrade", None) is not None:
+                if not existing_unit.upgraded and self.unit_types.can_upgrade(existing_unit.unit_type):
                     costs = self.type_cost(existing_unit.unit_type, True)
                     resources = self.get_resources()
                     if resources[SP] >= costs[SP] and resources[MP] >= costs[MP]:
                         self.__set_resource(SP, 0 - costs[SP])
                         self.__set_resource(MP, 0 - costs[MP])
-                        existing_unit.upgrade()
-                        self._build_stack.append((UPGRADE, x, y))
+                        self.game_map._upgrade_unit(existing_unit)
+                        self._build_stack.append((self.unit_types.UPGRADE, x, y))
                         spawned_units += 1
             else:
-                self.warn("Could not upgrade a unit from {}. Location has no structures or is enemy territory.".format(location))
+                self.warn("Could not upgrade a unit from {}. Location has no structures or is enemy territory.", location)
         return spawned_units
 
     def get_target_edge(self, start_location):
@@ -485,15 +748,72 @@ class GameState:
 
         """
         if self.contains_stationary_unit(start_location):
-            self.warn("Attempted to perform pathing from blocked starting location {}".format(start_location))
+            self.warn("Attempted to perform pathing from blocked starting location {}", start_location)
             return
+        return self.find_path_to_edge_unchecked(start_location, target_edge)
+
+    def find_path_to_edge_unchecked(self, start_location, target_edge=None):
+        """Gets the path a unit at a given location would take, without checking the start location
+
+        Like find_path_to_edge, for inner loops that already know the start location is in the arena and not blocked.
+
+        Args:
+            start_location: The location of a hypothetical unit
+            target_edge: The edge the unit wants to reach. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc. Induced from start_location if None.
 
+        Returns:
+            A list of locations corresponding to the path the unit would take
+
+        """
         if target_edge is None:
             target_edge = self.get_target_edge(start_location)
 
         end_points = self.game_map.get_edge_locations(target_edge)
         return self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
 
+    def find_paths_to_edge(self, start_locations, target_edge=None):
+        """Gets the paths units at several locations would take.
+        Equivalent to calling find_path_to_edge for each location, but the pathing
+        work is shared between locations that head to the same edge.
+
+        Args:
+            start_locations: A list of locations of hypothetical units
+            target_edge: The edge the units want to reach. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc. Induced from each start location if None.
+
+        Returns:
+            A list with the path for each start location, in the same order. 
+            The path is None for start locations that are blocked.
+
+        """
+        edge_groups = {}
+        for index, start_location in enumerate(start_locations):
+            if self.contains_stationary_unit(start_location):
+                self.warn("Attempted to perform pathing from blocked starting location {}", start_location)
+                continue
+            edge = self.get_target_edge(start_location) if target_edge is None else target_edge
+            edge_groups.setdefault(edge, []).append(index)
+
+        paths = [None] * len(start_locations)
+        for edge, indices in edge_groups.items():
+            end_points = self.game_map.get_edge_locations(edge)
+            edge_paths = self._shortest_path_finder.navigate_from_multiple_starts([start_locations[index] for index in indices], end_points, self)
+            for index, path in zip(indices, edge_paths):
+                paths[index] = path
+        return paths
+
+    def set_path_finder(self, path_finder):
+        """Sets the pathfinding engine used by find_path_to_edge
+
+        Args:
+            path_finder: A ShortestPathFinder, for example one with a different cache_size or with incremental set.
+                The same object can be reused across turns.
+
+        """
+        if not isinstance(path_finder, ShortestPathFinder):
+            self.warn("Passed a {} to set_path_finder. Expected a ShortestPathFinder.", type(path_finder))
+            return
+        self._shortest_path_finder = path_finder
+
     def contains_stationary_unit(self, location):
         """Check if a location is blocked, return structures unit if it is
 
@@ -513,12 +833,20 @@ class GameState:
                 return unit
         return False
 
-    def warn(self, message):
-        """ Used internally by game_state to print warnings
+    def warn(self, message, *args):
+        """ Used internally by game_state to print warnings.
+        The message is only formatted with args if the warning is printed,
+        so pass the values as args rather than formatting the message first.
         """
 
-        if(self.enable_warnings):
-            debug_write(message)
+        if self._warnings_enabled():
+            debug_write(message.format(*args) if args else message)
+
+    def _warnings_enabled(self):
+        """
+        Checks if warnings are printed, so callers can skip building messages that would be thrown away
+        """
+        return self.enable_warnings and util.log_level >= util.LOG_WARNINGS
 
     def suppress_warnings(self, suppress):
         """Suppress all warnings
@@ -529,7 +857,7 @@ class GameState:
         """
 
         self.enable_warnings = not suppress
-        self.game_map.enable_warnings = not suppress
+        self._game_map.enable_warnings = not suppress
 
     def get_target(self, attacking_unit):
         """Returns target of given unit based on current map of the game board. 
@@ -547,7 +875,7 @@ class GameState:
         """
 
         if not isinstance(attacking_unit, GameUnit):
-            self.warn("Passed a {} to get_target as attacking_unit. Expected a GameUnit.".format(type(attacking_unit)))
+            self.warn("Passed a {} to get_target as attacking_unit. Expected a GameUnit.", type(attacking_unit))
             return
 
         attacker_location = [attacking_unit.x, attacking_unit.y]
@@ -561,7 +889,7 @@ class GameState:
 
         for location in possible_locations:
             for unit in self.game_map[location]:
-                if unit.player_index == attacking_unit.player_index or (attacking_unit.damage_f == 0 and is_stationary(unit.unit_type)) or (attacking_unit.damage_i == 0 and not(is_stationary(unit.unit_type))):
+                if unit.player_index == attacking_unit.player_index or (attacking_unit.damage_f == 0 and self.unit_types.is_stationary(unit.unit_type)) or (attacking_unit.damage_i == 0 and not(self.unit_types.is_stationary(unit.unit_type))):
                     continue
 
                 new_target = False
@@ -610,6 +938,120 @@ class GameState:
                     target_x_distance = unit_x_distance
         return target
 
+    def get_targets(self, attacking_units):
+        """Returns the targets of many units at once, with the same targeting priority as get_target
+
+        The units of the map are bucketed by location once, in the index from get_target_index,
+        and each attacker only looks at the locations in its range.
+
+        Args:
+            attacking_units: A list of GameUnits
+
+        Returns:
+            A list with the GameUnit each unit would choose to attack, or None, in the same order
+
+        """
+        target_index = self.get_target_index()
+        targets = []
+        for attacking_unit in attacking_units:
+            if isinstance(attacking_unit, GameUnit) and (attacking_unit.player_index == 0 or attacking_unit.player_index == 1):
+                targets.append(target_index.get_target(attacking_unit))
+            else:
+                targets.append(self.get_target(attacking_unit))
+        return targets
+
+    def get_target_index(self):
+        """Gets the index of units by player and location used by get_targets
+
+        The index is cached and only rebuilt when game_map has changed since it was last built.
+
+        Returns:
+            A TargetIndex of the units on the map
+
+        """
+        target_index = self._target_index
+        if target_index is None or target_index.game_map is not self.game_map or target_index.version != self.game_map.version:
+            target_index = TargetIndex(self.game_map)
+            self._target_index = target_index
+        return target_index
+
+    def get_coverage_map(self, player_index):
+        """Gets the coverage map of the units threatening each location
+
+        The map is cached. When game_map has changed since, the cached map is updated for the
+        locations that changed, and only rebuilt after many changes or when game_map is replaced.
+
+        Args:
+            player_index: The index corresponding to the defending player, 0 for you 1 for the enemy
+
+        Returns:
+            A CoverageMap with the attackers, attacker count and summed damage of every location
+
+        """
+
+        if not player_index == 0 and not player_index == 1:
+            self._invalid_player_index(player_index)
+            return None
+
+        coverage = self._coverage_maps[player_index]
+        if coverage is None or coverage.game_map is not self.game_map or not coverage.update():
+            coverage = CoverageMap(self.game_map, player_index, self.__attack_search_range())
+            self._coverage_maps[player_index] = coverage
+        return coverage
+
+    def __attack_search_range(self):
+        max_range = 0
+        for unit in self.config["unitInformation"]:
+            if unit.get('attackRange', 0) >= max_range:
+                max_range = unit.get('attackRange', 0)
+        return max_range + self.config["unitInformation"][0]['getHitRadius']
+
+    def evaluate_path_damage(self, path, unit_type, player_index=0, cumulative=False):
+        """Estimates the damage a mobile unit would take following a path
+
+        Each location on the path is attacked once per frame the unit spends there, 1 / speed frames,
+        by the units in get_attackers. Shielding from friendly structures is subtracted the first time
+        the unit comes in range of each of them. The per location damage comes from get_coverage_map,
+        so scoring many paths against the same map only costs a lookup per location.
+
+        Args:
+            path: A list of locations, like the result of find_path_to_edge
+            unit_type: The type of mobile unit following the path
+            player_index: The index corresponding to the player controlling the unit, 0 for you 1 for the enemy
+            cumulative: If true, return the running total after each location instead of only the final total
+
+        Returns:
+            The damage taken minus the shielding gained along the path, or a list of running totals if cumulative is true
+
+        """
+
+        if not self.unit_types.is_unit(unit_type) or self.unit_types.is_stationary(unit_type):
+            self._invalid_unit(unit_type)
+            return
+        coverage = self.get_coverage_map(player_index)
+        if coverage is None:
+            return
+
+        speed = self.unit_types.template(unit_type).speed
+        frames = 1 / speed if speed > 0 else 1
+        damage = coverage.damage
+        shielders = coverage.shielders
+        index = self.game_map.topology.index
+        shielded = set()
+        total = 0
+        totals = []
+        for location in path or []:
+            location_index = index(location)
+            if location_index >= 0:
+                total += damage[location_index] * frames
+                for unit in shielders[location_index]:
+                    if id(unit) not in shielded:
+                        shielded.add(id(unit))
+                        total -= unit.shieldPerUnit
+            if cumulative:
+                totals.append(total)
+        return totals if cumulative else total
+
     def get_attackers(self, location, player_index):
         """Gets the stationary units threatening a given location
 
@@ -625,7 +1067,9 @@ class GameState:
         if not player_index == 0 and not player_index == 1:
             self._invalid_player_index(player_index)
         if not self.game_map.in_arena_bounds(location):
-            self.warn("Location {} is not in the arena bounds.".format(location))
+            self.warn("Location {} is not in the arena bounds.", location)
+        elif player_index == 0 or player_index == 1:
+            return self.get_attackers_unchecked(location, player_index)
 
         attackers = []
         """
@@ -641,3 +1085,18 @@ class GameState:
                 if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and self.game_map.distance_between_locations(location, location_unit) <= unit.attackRange:
                     attackers.append(unit)
         return attackers
+
+    def get_attackers_unchecked(self, location, player_index):
+        """Gets the stationary units threatening a given location, without checking the arguments
+
+        Like get_attackers, for inner loops that already know the location is in the arena.
+
+        Args:
+            location: The location of a hypothetical defender, which must be in the arena
+            player_index: The index corresponding to the defending player, 0 for you 1 for the enemy
+
+        Returns:
+            A list of units that would attack a unit controlled by the given player at the given location
+
+        """
+        return self.get_coverage_map(player_index).get_attackers(location)
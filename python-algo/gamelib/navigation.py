@@ -1,25 +1,74 @@
 import heapq
-import math
 import sys
-import queue
+import threading
+from collections import OrderedDict, deque
 from .util import debug_write
+from .topology import get_topology, iter_bits, popcount
 
 class Node:
     """A pathfinding node
 
+    Nodes are reused between searches. Instead of a bool, each flag holds the epoch in which it was last set,
+    and only counts as set while that epoch is the current one of its SearchWorkspace.
+
     Attributes :
-        * visited_idealness (bool): Have we visited this node during the idealness search step?
-        * visited_validate (bool): Have we visited this node during the validation step?
-        * blocked (bool): Is there a structures at this node's location
+        * visited_idealness (int): The idealness search epoch in which we visited this node
+        * visited_validate (int): The validation epoch in which we visited this node. pathlength is only valid during that epoch
+        * blocked (int): The map epoch in which there was a structure at this node's location
         * pathlength: The distance between this node and the target location
 
     """
     def __init__(self):
-        self.visited_idealness = False
-        self.visited_validate = False
-        self.blocked = False
+        self.visited_idealness = 0
+        self.visited_validate = 0
+        self.blocked = 0
         self.pathlength = -1
 
+class SearchWorkspace:
+    """The grid of Nodes used by ShortestPathFinder
+
+    A workspace is allocated once per arena size and thread, and shared by every pathfinder on
+    that thread, so pathing for many GameStates does not allocate new Nodes.
+    Starting a new search step only advances that step's epoch, which makes every flag set in an older epoch stale.
+
+    Attributes :
+        * arena_size (int): The size of the arena
+        * nodes (list): nodes[x][y] is the Node for location [x, y]
+        * map_epoch (int): The current epoch of Node.blocked
+        * idealness_epoch (int): The current epoch of Node.visited_idealness
+        * validate_epoch (int): The current epoch of Node.visited_validate
+        * owner: The pathfinder that filled in the nodes most recently
+
+    """
+    _local = threading.local()
+
+    def __init__(self, arena_size):
+        self.arena_size = arena_size
+        self.nodes = [[Node() for x in range(arena_size)] for y in range(arena_size)]
+        self.map_epoch = 0
+        self.idealness_epoch = 0
+        self.validate_epoch = 0
+        self.owner = None
+
+    @classmethod
+    def for_arena(cls, arena_size):
+        """Gets the workspace of this thread for the given arena size, allocating it on first use
+        """
+        workspaces = getattr(cls._local, "workspaces", None)
+        if workspaces is None:
+            workspaces = cls._local.workspaces = {}
+        if arena_size not in workspaces:
+            workspaces[arena_size] = cls(arena_size)
+        return workspaces[arena_size]
+
+    def reset(self, owner):
+        """Starts a new search, clearing every Node in O(1)
+        """
+        self.owner = owner
+        self.map_epoch += 1
+        self.idealness_epoch += 1
+        self.validate_epoch += 1
+
 """
 This class helps with pathfinding. We guarantee the results will
 be accurate, but top players may want to write their own pathfinding
@@ -33,13 +82,23 @@ class ShortestPathFinder:
         * VERTICAL (int): A constant representing a vertical movement
 
         * game_state (:obj: GameState): The current gamestate
-        * game_map (:obj: GameMap): The current gamemap
+        * game_map (list): The Nodes of the current search, game_map[x][y]
+        * workspace (:obj: SearchWorkspace): The workspace holding game_map
+        * cache_size (int): The number of paths remembered by navigate_multiple_endpoints. 0 disables the cache
+        * incremental (bool): If true, the pathlengths of the last search are kept and repaired when a few structures
+            are added or removed, instead of searching the whole map again
 
     """
-    def __init__(self):
+    MAX_REPAIRS = 4
+
+    def __init__(self, cache_size=256, incremental=False):
         self.HORIZONTAL = 1
         self.VERTICAL = 2
         self.initialized = False
+        self.cache_size = cache_size
+        self.incremental = incremental
+        self._path_cache = OrderedDict()
+        self._field = None
 
     def initialize_map(self, game_state):
         """Initializes the map
@@ -50,7 +109,10 @@ class ShortestPathFinder:
         #Initialize map 
         self.initialized = True
         self.game_state = game_state
-        self.game_map = [[Node() for x in range(self.game_state.ARENA_SIZE)] for y in range(self.game_state.ARENA_SIZE)]
+        self.topology = get_topology(self.game_state.ARENA_SIZE)
+        self.workspace = SearchWorkspace.for_arena(self.game_state.ARENA_SIZE)
+        self.workspace.reset(self)
+        self.game_map = self.workspace.nodes
 
     def navigate_multiple_endpoints(self, start_point, end_points, game_state):
         """Finds the path a unit would take to reach a set of endpoints
@@ -68,44 +130,325 @@ class ShortestPathFinder:
         if game_state.contains_stationary_unit(start_point):
             return
 
+        path = self._get_cached_path(start_point, end_points, game_state)
+        if path is None:
+            path = self._navigate(start_point, end_points, game_state)
+            self._cache_path(start_point, end_points, game_state, path)
+        return path
+
+    def navigate_from_multiple_starts(self, start_points, end_points, game_state):
+        """Finds the paths units at several locations would take to reach the same set of endpoints
+
+        Units in the same pocket of pathable space share their pathlengths, so the
+        validation step is only done once for each pocket instead of once per unit.
+
+        Args:
+            * start_points: A list of starting locations
+            * end_points: The end points of the units, should be a list of edge locations
+            * game_state: The current game state
+
+        Returns:
+            A list with the path from each of the start_points, in the same order as navigate_multiple_endpoints would return them.
+            The path is None for start points blocked by a structure.
+
+        """
+        paths = [None] * len(start_points)
+        pockets = []
+        groups = {}
+        prepared = False
+        for index, start_point in enumerate(start_points):
+            if game_state.contains_stationary_unit(start_point):
+                continue
+            paths[index] = self._get_cached_path(start_point, end_points, game_state)
+            if paths[index] is not None:
+                continue
+
+            if not prepared:
+                self._prepare(game_state)
+                prepared = True
+            for pocket, ideal_tile in pockets:
+                if self._in_pocket(pocket, start_point):
+                    break
+            else:
+                pocket, ideal_tile = self._pocket_search(start_point, end_points)
+                pockets.append((pocket, ideal_tile))
+
+            # Every pocket that reaches the edge validates from the whole edge, so they can share one search
+            group = None if ideal_tile in end_points else tuple(ideal_tile)
+            groups.setdefault(group, (ideal_tile, []))[1].append(index)
+
+        for count, (ideal_tile, indices) in enumerate(groups.values()):
+            if count > 0:
+                self._reset_validation()
+            self._validate(ideal_tile, end_points)
+            for index in indices:
+                paths[index] = self._get_path(start_points[index], end_points)
+                self._cache_path(start_points[index], end_points, game_state, paths[index])
+        return paths
+
+    def clear_cache(self):
+        """Forgets every path remembered by navigate_multiple_endpoints
+
+        """
+        self._path_cache.clear()
+
+    def _cache_key(self, start_point, end_points, game_state):
+        # Paths only depend on the structure layout, so a path found for the same layout, start and edge can be reused
+        return (game_state.game_map.get_structure_bitboard(), tuple(start_point), tuple(map(tuple, end_points)))
+
+    def _get_cached_path(self, start_point, end_points, game_state):
+        """Returns a copy of the cached path for this layout, start and edge, or None if there is none
+        """
+        if self.cache_size <= 0:
+            return None
+        key = self._cache_key(start_point, end_points, game_state)
+        path = self._path_cache.get(key)
+        if path is None:
+            return None
+        self._path_cache.move_to_end(key)
+        return [list(location) for location in path]
+
+    def _cache_path(self, start_point, end_points, game_state, path):
+        if self.cache_size <= 0:
+            return
+        self._path_cache[self._cache_key(start_point, end_points, game_state)] = tuple(map(tuple, path))
+        if len(self._path_cache) > self.cache_size:
+            self._path_cache.popitem(last=False)
+
+    def _prepare(self, game_state):
+        """Initializes the map and fills in the walls
+        """
+        self._field = None
         #Initialize map 
         self.initialize_map(game_state)
         #Fill in walls
-        for location in self.game_state.game_map:
-            if self.game_state.contains_stationary_unit(location):
-                self.game_map[location[0]][location[1]].blocked = True
+        index_location = self.topology.index_location
+        for index in iter_bits(game_state.game_map.get_structure_bitboard()):
+            x, y = index_location[index]
+            self.game_map[x][y].blocked = self.workspace.map_epoch
+
+    def _navigate(self, start_point, end_points, game_state):
+        """Does the pathfinding for navigate_multiple_endpoints, without using the path cache
+        """
+        if self.incremental:
+            path = self._navigate_incremental(start_point, end_points, game_state)
+            if path is not None:
+                return path
+
+        self._prepare(game_state)
         #Do pathfinding
         ideal_endpoints = self._idealness_search(start_point, end_points)
         self._validate(ideal_endpoints, end_points)
+        if self.incremental:
+            ideal_tile = None if ideal_endpoints in end_points else list(ideal_endpoints)
+            self._field = (game_state.game_map.get_structure_bitboard(), tuple(map(tuple, end_points)), ideal_tile)
         return self._get_path(start_point, end_points)
 
+    def _navigate_incremental(self, start_point, end_points, game_state):
+        """Reuses the pathlengths of the last search if the layout differs from it by a few structures
+
+        Returns:
+            The path, or None if the pathlengths could not be reused and a full search is needed
+        """
+        if self._field is None or not self._owns_workspace():
+            return None
+        layout, field_end_points, ideal_tile = self._field
+        if field_end_points != tuple(map(tuple, end_points)):
+            return None
+
+        new_layout = game_state.game_map.get_structure_bitboard()
+        if popcount(layout ^ new_layout) > self.MAX_REPAIRS:
+            return None
+        self.game_state = game_state
+        # Each structure is repaired separately, so the pathlengths are correct for every layout in between
+        for index in iter_bits(layout & ~new_layout):
+            if not self._repair_unblocked(list(self.topology.index_location[index]), end_points, ideal_tile):
+                self._field = None
+                return None
+        for index in iter_bits(new_layout & ~layout):
+            if not self._repair_blocked(list(self.topology.index_location[index]), end_points, ideal_tile):
+                self._field = None
+                return None
+        self._field = (new_layout, field_end_points, ideal_tile)
+
+        # The pathlengths only cover the pockets connected to the search's targets. Any other start needs a new search
+        if self._pathlength_at(start_point) == -1:
+            return None
+        return self._get_path(start_point, end_points)
+
+    def _repair_blocked(self, location, end_points, ideal_tile):
+        """Updates the pathlengths after a structure is placed at location
+
+        Only the locations whose shortest paths went through location are searched again.
+
+        Returns:
+            False if the pathlengths cannot be repaired because the unit's target changed
+        """
+        if ideal_tile is not None and location == ideal_tile:
+            return False
+        pathlength = self._pathlength_at(location)
+        self._set_blocked(location, True)
+        if location not in end_points:
+            self._set_pathlength(location, -1)
+        if pathlength == -1:
+            return True
+
+        # Find the locations left without a neighbor one step closer to the target, nearest first
+        orphans = set()
+        level = [neighbor for neighbor in self._arena_neighbors(location) if self._pathlength_at(neighbor) == pathlength + 1]
+        while level:
+            next_level = []
+            for candidate in level:
+                key = tuple(candidate)
+                if key in orphans or self._blocked_at(candidate):
+                    continue
+                candidate_pathlength = self._pathlength_at(candidate)
+                supported = False
+                for neighbor in self._arena_neighbors(candidate):
+                    if not self._blocked_at(neighbor) and tuple(neighbor) not in orphans and self._pathlength_at(neighbor) == candidate_pathlength - 1:
+                        supported = True
+                        break
+                if supported:
+                    continue
+                orphans.add(key)
+                for neighbor in self._arena_neighbors(candidate):
+                    if self._pathlength_at(neighbor) == candidate_pathlength + 1:
+                        next_level.append(neighbor)
+            level = next_level
+
+        # Give the orphans new pathlengths, growing out from their remaining neighbors
+        heap = []
+        for orphan in orphans:
+            self._set_pathlength(orphan, -1)
+        for orphan in orphans:
+            best = -1
+            for neighbor in self._arena_neighbors(orphan):
+                neighbor_pathlength = self._pathlength_at(neighbor)
+                if neighbor_pathlength != -1 and not self._blocked_at(neighbor) and (best == -1 or neighbor_pathlength + 1 < best):
+                    best = neighbor_pathlength + 1
+            if best != -1:
+                heapq.heappush(heap, (best, orphan))
+        while heap:
+            pathlength, orphan = heapq.heappop(heap)
+            current_pathlength = self._pathlength_at(orphan)
+            if current_pathlength != -1 and current_pathlength <= pathlength:
+                continue
+            self._set_pathlength(orphan, pathlength)
+            for neighbor in self._arena_neighbors(orphan):
+                if tuple(neighbor) in orphans:
+                    neighbor_pathlength = self._pathlength_at(neighbor)
+                    if neighbor_pathlength == -1 or neighbor_pathlength > pathlength + 1:
+                        heapq.heappush(heap, (pathlength + 1, tuple(neighbor)))
+        return True
+
+    def _repair_unblocked(self, location, end_points, ideal_tile):
+        """Updates the pathlengths after the structure at location is removed
+
+        Returns:
+            False if the pathlengths cannot be repaired because the unit's pocket changed
+        """
+        self._set_blocked(location, False)
+        reached = [neighbor for neighbor in self._arena_neighbors(location) if self._pathlength_at(neighbor) != -1 and not self._blocked_at(neighbor)]
+        if ideal_tile is not None:
+            # Opening a location next to a self destruct pocket can change the most ideal tile of that pocket
+            return len(reached) == 0
+
+        if location in end_points:
+            self._set_pathlength(location, 0)
+        elif reached:
+            self._set_pathlength(location, min(self._pathlength_at(neighbor) for neighbor in reached) + 1)
+        else:
+            return True
+
+        current = deque([location])
+        while current:
+            current_location = current.popleft()
+            pathlength = self._pathlength_at(current_location) + 1
+            for neighbor in self._arena_neighbors(current_location):
+                if self._blocked_at(neighbor):
+                    continue
+                neighbor_pathlength = self._pathlength_at(neighbor)
+                if neighbor_pathlength == -1 or neighbor_pathlength > pathlength:
+                    self._set_pathlength(neighbor, pathlength)
+                    current.append(neighbor)
+        return True
+
+    def _owns_workspace(self):
+        """Checks that no other pathfinder has used the workspace since our last search
+        """
+        return self.workspace.owner is self
+
+    def _pathlength_at(self, location):
+        node = self.game_map[location[0]][location[1]]
+        return node.pathlength if node.visited_validate == self.workspace.validate_epoch else -1
+
+    def _set_pathlength(self, location, pathlength):
+        node = self.game_map[location[0]][location[1]]
+        node.pathlength = pathlength
+        node.visited_validate = self.workspace.validate_epoch
+
+    def _blocked_at(self, location):
+        return self.game_map[location[0]][location[1]].blocked == self.workspace.map_epoch
+
+    def _set_blocked(self, location, blocked):
+        self.game_map[location[0]][location[1]].blocked = self.workspace.map_epoch if blocked else 0
+
+    def _arena_neighbors(self, location):
+        return self.topology.neighbor_locations[location[0]][location[1]]
+
+    def _pocket_search(self, start, end_points):
+        """Runs the idealness search from start
+
+        Returns:
+            The pocket of pathable space containing start, and the most ideal tile in it
+        """
+        # Pockets never overlap, so the epoch of the search identifies the pocket
+        self.workspace.idealness_epoch += 1
+        ideal_tile = self._idealness_search(start, end_points)
+        return self.workspace.idealness_epoch, ideal_tile
+
+    def _in_pocket(self, pocket, location):
+        return self.game_map[location[0]][location[1]].visited_idealness == pocket
+
+    def _reset_validation(self):
+        """Clears the pathlengths set by a previous validation step
+        """
+        self.workspace.validate_epoch += 1
+
     def _idealness_search(self, start, end_points):
         """
         Finds the most ideal tile in our 'pocket' of pathable space. 
         The edge if it is available, or the best self destruct location otherwise
         """
-        current = queue.Queue()
-        current.put(start)
+        map_epoch = self.workspace.map_epoch
+        idealness_epoch = self.workspace.idealness_epoch
+        neighbor_locations = self.topology.neighbor_locations
+        end_set = set(map(tuple, end_points))
+        direction = self._get_direction_from_endpoints(end_points)
+        current = deque([start])
         best_idealness = self._get_idealness(start, end_points)
-        self.game_map[start[0]][start[1]].visited_idealness = True
+        self.game_map[start[0]][start[1]].visited_idealness = idealness_epoch
         most_ideal = start
 
-        while not current.empty():
-            search_location = current.get()
-            for neighbor in self._get_neighbors(search_location):
-                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+        while current:
+            search_location = current.popleft()
+            for neighbor in neighbor_locations[search_location[0]][search_location[1]]:
+                x, y = neighbor
+                node = self.game_map[x][y]
+                # Every location in the pocket is visited once, so its idealness only needs to be checked then
+                if node.blocked == map_epoch or node.visited_idealness == idealness_epoch:
                     continue
+                node.visited_idealness = idealness_epoch
+                current.append(neighbor)
 
-                x, y = neighbor
-                current_idealness = self._get_idealness(neighbor, end_points)
+                if neighbor in end_set:
+                    current_idealness = sys.maxsize
+                else:
+                    current_idealness = 28 * (y if direction[1] == 1 else 27 - y) + (x if direction[0] == 1 else 27 - x)
 
                 if current_idealness > best_idealness:
                     best_idealness = current_idealness
-                    most_ideal = neighbor
-
-                if not self.game_map[x][y].visited_idealness and not self.game_map[x][y].blocked:
-                    self.game_map[x][y].visited_idealness = True
-                    current.put(neighbor)
+                    most_ideal = list(neighbor)
 
         return most_ideal
 
@@ -164,31 +507,34 @@ class ShortestPathFinder:
         """
         #VALDIATION
         #Add our most ideal tiles to current
-        current = queue.Queue()
+        map_epoch = self.workspace.map_epoch
+        validate_epoch = self.workspace.validate_epoch
+        current = deque()
         if ideal_tile in end_points:
             for location in end_points:
-               current.put(location)
+               current.append(location)
                #Set current pathlength to 0
                self.game_map[location[0]][location[1]].pathlength = 0
-               self.game_map[location[0]][location[1]].visited_validate = True
+               self.game_map[location[0]][location[1]].visited_validate = validate_epoch
         else:
-            current.put(ideal_tile)
+            current.append(ideal_tile)
             self.game_map[ideal_tile[0]][ideal_tile[1]].pathlength = 0
-            self.game_map[ideal_tile[0]][ideal_tile[1]].visited_validate = True
+            self.game_map[ideal_tile[0]][ideal_tile[1]].visited_validate = validate_epoch
 
         #While current is not empty
-        while not current.empty():
-            current_location = current.get()
+        neighbor_locations = self.topology.neighbor_locations
+        while current:
+            current_location = current.popleft()
             current_node = self.game_map[current_location[0]][current_location[1]]
-            for neighbor in self._get_neighbors(current_location):
-                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+            for neighbor in neighbor_locations[current_location[0]][current_location[1]]:
+                if self.game_map[neighbor[0]][neighbor[1]].blocked == map_epoch:
                     continue
 
                 neighbor_node = self.game_map[neighbor[0]][neighbor[1]]
-                if not neighbor_node.visited_validate and not current_node.blocked:
+                if not neighbor_node.visited_validate == validate_epoch and not current_node.blocked == map_epoch:
                     neighbor_node.pathlength = current_node.pathlength + 1
-                    neighbor_node.visited_validate = True
-                    current.put(neighbor)
+                    neighbor_node.visited_validate = validate_epoch
+                    current.append(neighbor)
 
         #debug_write("Print after validate")
         #self.print_map()
@@ -203,8 +549,8 @@ class ShortestPathFinder:
         current = start_point
         move_direction = 0
 
-        while not self.game_map[current[0]][current[1]].pathlength == 0:
-            #debug_write("current tile {} has cost {}".format(current, self.game_map[current[0]][current[1]].pathlength))
+        while not self._pathlength_at(current) == 0:
+            #debug_write("current tile {} has cost {}".format(current, self._pathlength_at(current)))
             next_move = self._choose_next_move(current, move_direction, end_points)
             #debug_write(next_move)
 
@@ -212,7 +558,7 @@ class ShortestPathFinder:
                 move_direction = self.VERTICAL
             else:
                 move_direction = self.HORIZONTAL
-            path.append(next_move)
+            path.append(list(next_move))
             current = next_move
         
         #debug_write(path)
@@ -221,19 +567,18 @@ class ShortestPathFinder:
     def _choose_next_move(self, current_point, previous_move_direction, end_points):
         """Given the current location and adjacent locations, return the best 'next step' for a given unit to take
         """
-        neighbors = self._get_neighbors(current_point)
+        neighbors = self.topology.neighbor_locations[current_point[0]][current_point[1]]
         #debug_write("Unit at {} previously moved {} and has these neighbors {}".format(current_point, previous_move_direction, neighbors))
 
         ideal_neighbor = current_point
-        best_pathlength = self.game_map[current_point[0]][current_point[1]].pathlength
+        best_pathlength = self._pathlength_at(current_point)
         for neighbor in neighbors:
             #debug_write("Comparing champ {} and contender {}".format(ideal_neighbor, neighbor))
-            if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+            if self._blocked_at(neighbor):
                 continue
 
             new_best = False
-            x, y = neighbor
-            current_pathlength = self.game_map[x][y].pathlength
+            current_pathlength = self._pathlength_at(neighbor)
 
             #Filter by pathlength
             if current_pathlength > best_pathlength:
@@ -299,9 +644,9 @@ class ShortestPathFinder:
 
         for y in range(28):
             for x in range(28):
-                node = self.game_map[x][28 - y - 1]
-                if not node.blocked and not node.pathlength == -1:
-                    self._print_justified(node.pathlength)
+                location = [x, 28 - y - 1]
+                if not self._blocked_at(location) and not self._pathlength_at(location) == -1:
+                    self._print_justified(self._pathlength_at(location))
                 else:
                     sys.stderr.write("   ")
             debug_write("")
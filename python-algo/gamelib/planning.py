@@ -0,0 +1,251 @@
+import json
+import threading
+import time
+
+from .game_state import GameState
+from .util import debug_write, send_command
+
+
+class PlanCancelled(Exception):
+    """Raised by BackgroundPlan.check in a background planning worker to stop it
+    """
+
+
+class BackgroundPlan:
+    """Planning for the next turn, run in a worker thread while the action phase plays out
+
+    AlgoCore creates one on the first action frame of a turn if background_planning is enabled,
+    passes it to AlgoCore.plan_next_turn in a worker thread, and keeps it updated with the latest
+    frame. When the next turn message arrives it is cancelled, and the result is stored in
+    AlgoCore.background_result before on_turn is called.
+
+    The worker is a thread, so plan_next_turn should call check() or look at cancelled regularly,
+    and return soon after it is set. It can store its best result so far in result at any time.
+    If it is still running background_timeout seconds after being cancelled, AlgoCore logs it,
+    abandons the worker and uses the result stored so far. A thread can not be stopped safely from
+    outside, so an abandoned worker keeps running until it returns, and what it returns is dropped.
+
+    Attributes :
+        * config (JSON): Contains information about the game
+        * cancelled (:obj: threading.Event): Set when the next turn arrives and planning should stop
+        * result: The result handed to on_turn. Set by plan_next_turn, or to its return value when it finishes
+        * frame_count (int): The number of action frames received so far
+
+    """
+    def __init__(self, config, frame):
+        """Sets up the plan with the first action frame of the turn
+
+        Args:
+            config (JSON): Contains information about the game
+            frame (string): The raw action frame message
+
+        """
+        self.config = config
+        self.cancelled = threading.Event()
+        self.result = None
+        self.frame_count = 0
+        self.__frame = None
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__abandoned = False
+        self.update(frame)
+
+    def update(self, frame):
+        """Records a new action frame. Called by AlgoCore for every frame
+        """
+        with self.__lock:
+            self.__frame = frame
+            self.frame_count += 1
+
+    def latest_frame(self):
+        """Gets the latest action frame
+
+        Returns:
+            The raw action frame message
+
+        """
+        with self.__lock:
+            return self.__frame
+
+    def predicted_state(self, lazy=False):
+        """Builds a prediction of the next turn's GameState from the latest action frame
+
+        The board is taken as it is in the frame, the turn number is advanced, and MP and SP are
+        projected with project_future_MP and project_future_SP from the units in the frame.
+
+        Args:
+            lazy (bool): If true, the units are only added to game_map the first time it is used
+
+        Returns:
+            The predicted GameState
+
+        """
+        state = GameState(self.config, self.latest_frame(), lazy)
+        for player_index in (0, 1):
+            state._player_resources[player_index]['MP'] = state.project_future_MP(1, player_index)
+            state._player_resources[player_index]['SP'] = state.project_future_SP(1, player_index)
+        state.turn_number += 1
+        return state
+
+    def check(self):
+        """Stops the worker if planning has been cancelled. Meant to be called between steps of plan_next_turn
+
+        Raises:
+            PlanCancelled: If cancelled is set. The worker stops quietly, and result is kept
+
+        """
+        if self.cancelled.is_set():
+            raise PlanCancelled()
+
+    def start(self, target):
+        """Runs target(self) in a daemon worker thread. Called by AlgoCore
+        """
+        def run():
+            try:
+                result = target(self)
+            except PlanCancelled:
+                return
+            except Exception as e:
+                debug_write("Background planning failed: {}".format(e))
+                return
+            if result is not None and not self.__abandoned:
+                self.result = result
+
+        self.__thread = threading.Thread(target=run, name="background-plan", daemon=True)
+        self.__thread.start()
+
+    def cancel(self, timeout=None):
+        """Asks the worker to stop and waits for it
+
+        Args:
+            timeout: The longest time to wait for the worker, in seconds. None waits until it finishes
+
+        Returns:
+            True if the worker has stopped, False if it is still running after timeout
+
+        """
+        self.cancelled.set()
+        if self.__thread is None:
+            return True
+        self.__thread.join(timeout)
+        return not self.__thread.is_alive()
+
+    def abandon(self):
+        """Gives up on a worker that did not stop after cancel. Called by AlgoCore
+
+        The worker thread is a daemon and keeps running until it returns, but its return value is no longer stored in result.
+        """
+        self.cancelled.set()
+        self.__abandoned = True
+
+
+class TurnBudget:
+    """The time left to submit the current turn
+
+    AlgoCore creates one when a turn message arrives and makes it available to on_turn as
+    self.turn_budget. Searches can call check() between steps to stop in time, and offer()
+    their best turn so far. Setting a GameState's turn_budget makes its submit_turn go through
+    submit(), which only sends the first turn submitted, so a watchdog started with
+    start_watchdog can safely submit the best offered turn if the strategy runs too long.
+
+    Attributes :
+        * limit (float): The length of the budget in seconds
+        * deadline (float): The time.perf_counter() value the budget runs out at
+        * submitted (bool): If a turn has been submitted with this budget
+
+    """
+    def __init__(self, limit, start=None):
+        """Starts the budget
+
+        Args:
+            limit (float): The length of the budget in seconds
+            start (float): The time.perf_counter() value the budget starts at, now if not given
+
+        """
+        self.limit = limit
+        self.deadline = (start if start is not None else time.perf_counter()) + limit
+        self.submitted = False
+        self.__best = None
+        self.__lock = threading.Lock()
+        self.__watchdog = None
+
+    def remaining(self):
+        """Gets the time left
+
+        Returns:
+            The seconds left before the deadline, 0 if it has passed
+
+        """
+        return max(0.0, self.deadline - time.perf_counter())
+
+    def check(self, reserve=0):
+        """Checks if a search should keep going. Meant to be called between steps of a search
+
+        Args:
+            reserve (float): Seconds to keep in hand, for example to finish up and submit
+
+        Returns:
+            True if more than reserve seconds are left and no turn has been submitted, False otherwise
+
+        """
+        return not self.submitted and self.deadline - time.perf_counter() > reserve
+
+    def offer(self, game_state):
+        """Records the turn planned in a GameState as the best found so far
+
+        The planned units are copied, so the GameState can keep being changed afterwards.
+
+        Args:
+            game_state: A GameState holding the turn to submit if time runs out
+
+        """
+        turn = (list(game_state._build_stack), list(game_state._deploy_stack))
+        with self.__lock:
+            self.__best = turn
+
+    def submit(self, game_state=None):
+        """Submits a turn, unless a turn has already been submitted with this budget
+
+        Args:
+            game_state: The GameState to submit. If not given, the best offered turn is submitted, or an empty turn if none was offered
+
+        Returns:
+            True if this call submitted the turn, False if it had already been submitted
+
+        """
+        with self.__lock:
+            if self.submitted:
+                return False
+            if game_state is not None:
+                build_stack, deploy_stack = game_state._build_stack, game_state._deploy_stack
+            elif self.__best is not None:
+                build_stack, deploy_stack = self.__best
+            else:
+                build_stack, deploy_stack = [], []
+            send_command(json.dumps(build_stack))
+            send_command(json.dumps(deploy_stack))
+            self.submitted = True
+        self.cancel()
+        return True
+
+    def start_watchdog(self, margin):
+        """Submits the best offered turn margin seconds before the deadline, if nothing has been submitted by then
+
+        Args:
+            margin (float): How many seconds before the deadline to submit
+
+        """
+        def expire():
+            if self.submit():
+                debug_write("Turn budget ran out, submitted the best turn found so far")
+
+        self.cancel()
+        self.__watchdog = threading.Timer(max(0.0, self.remaining() - margin), expire)
+        self.__watchdog.daemon = True
+        self.__watchdog.start()
+
+    def cancel(self):
+        """Stops the watchdog, if it is running
+        """
+        if self.__watchdog is not None:
+            self.__watchdog.cancel()
@@ -0,0 +1,80 @@
+import math
+
+
+class TargetIndex:
+    """The units of each player bucketed by location, for resolving the targets of many attackers
+
+    Structures and mobile units are kept apart, in dicts from topology index to the units of one
+    player at that location. An attacker only looks at the locations in its range, which come from
+    the memoized range neighborhoods of the topology. GameState.get_target_index keeps one and rebuilds
+    it when the GameMap version changes. Units are not copied, so health changes are seen right away.
+
+    Attributes :
+        * game_map (:obj: GameMap): The map the index was built from
+        * version (int): The GameMap version the index was built from
+        * structures (tuple): structures[p] maps a topology index to the structures of player p there
+        * mobiles (tuple): mobiles[p] maps a topology index to the mobile units of player p there
+
+    """
+    def __init__(self, game_map):
+        """Builds the index
+
+        Args:
+            game_map: The GameMap to read units from
+
+        """
+        self.game_map = game_map
+        self.version = game_map.version
+        self.structures = ({}, {})
+        self.mobiles = ({}, {})
+        self.__center_x = game_map.HALF_ARENA - 0.5
+
+        location_index = game_map.topology.location_index
+        for location in game_map.iter_occupied():
+            index = location_index[location[0]][location[1]]
+            for unit in game_map._units_at(location[0], location[1]):
+                if unit.player_index == 0 or unit.player_index == 1:
+                    buckets = self.structures if unit.stationary else self.mobiles
+                    buckets[unit.player_index].setdefault(index, []).append(unit)
+
+    def get_target(self, attacking_unit):
+        """Gets the unit an attacker would target, with the same priorities as GameState.get_target
+
+        Args:
+            attacking_unit: A GameUnit controlled by player 0 or 1
+
+        Returns:
+            The GameUnit this unit would choose to attack, or None if nothing is in range
+
+        """
+        player_index = attacking_unit.player_index
+        enemy_index = 1 - player_index
+        x, y = attacking_unit.x, attacking_unit.y
+        indices = self.game_map.get_location_indices_in_range([x, y], attacking_unit.attackRange)
+        index_location = self.game_map.topology.index_location
+        # Lower y is preferred when attacking for player 0, higher y when attacking for player 1
+        y_sign = 1 if player_index == 0 else -1
+
+        # Mobile units are always preferred, so structures are only looked at if no mobile unit is in range
+        groups = []
+        if attacking_unit.damage_i != 0:
+            groups.append(self.mobiles[enemy_index])
+        if attacking_unit.damage_f != 0:
+            groups.append(self.structures[enemy_index])
+        for buckets in groups:
+            target = None
+            target_key = None
+            for index in indices:
+                units = buckets.get(index)
+                if not units:
+                    continue
+                unit_x, unit_y = index_location[index]
+                distance = math.sqrt((unit_x - x) ** 2 + (unit_y - y) ** 2)
+                for unit in units:
+                    key = (distance, unit.health, y_sign * unit.y, -abs(self.__center_x - unit.x))
+                    if target_key is None or key < target_key:
+                        target = unit
+                        target_key = key
+            if target is not None:
+                return target
+        return None
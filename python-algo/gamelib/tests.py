@@ -1,7 +1,18 @@
 import unittest
+import copy
 import json
-from .game_state import GameState
+import threading
+import time
+from unittest import mock
+from .game_state import GameState, np
 from .unit import GameUnit
+from .algocore import AlgoCore
+from .planning import TurnBudget, BackgroundPlan
+from .unit_types import get_unit_type_registry
+from .navigation import ShortestPathFinder, SearchWorkspace
+from .topology import iter_bits
+from .coverage import CoverageMap
+from . import util
 
 class BasicTests(unittest.TestCase):
 
@@ -215,6 +226,80 @@ class BasicTests(unittest.TestCase):
         self.assertEqual([("DF", 13, 6)], game._build_stack, "Build queue is wrong!")
         self.assertEqual([("SI", 13, 0), ("SI", 13, 0), ("SI", 13, 0)], game._deploy_stack, "Deploy queue is wrong!")
 
+    def test_get_targets(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        game_map.add_unit("DF", [13, 10], 0)
+        game_map.add_unit("PI", [13, 0], 0)
+        game_map.add_unit("FF", [13, 12], 1)
+        game_map.add_unit("FF", [14, 12], 1)
+        game_map.add_unit("SI", [12, 12], 1, 2)
+        game_map.add_unit("PI", [13, 13], 1)
+        game_map[14, 12][0].health = 10
+        attackers = [game_map[13, 10][0], game_map[13, 0][0], game_map[12, 12][0], game_map[13, 13][0]]
+        targets = game.get_targets(attackers)
+        self.assertEqual([game.get_target(unit) for unit in attackers], targets, "get_targets should match get_target")
+        self.assertIs(game_map[12, 12][0], targets[0], "Turrets should prefer mobile units")
+        self.assertEqual([None, None], targets[1:3], "Units with nothing they can hit in range have no target")
+        self.assertIs(game_map[13, 10][0], targets[3], "Scouts should target structures in range")
+
+        game_map.remove_unit([12, 12])
+        self.assertEqual([None], game.get_targets(attackers[:1]), "Index should follow changes to the map")
+        self.assertIs(game.get_target_index(), game.get_target_index(), "Index should be cached while the map is unchanged")
+
+    def test_lazy_warnings(self):
+        game = self.make_turn_0_map()
+        game.suppress_warnings(False)
+        location = mock.MagicMock()
+        location.__format__ = mock.Mock(return_value="somewhere")
+        with mock.patch("gamelib.game_state.debug_write") as debug:
+            game.warn("Could not use {}", location)
+            self.assertEqual([mock.call("Could not use somewhere")], debug.call_args_list, "Warning should be formatted when printed")
+
+            location.__format__.reset_mock()
+            debug.reset_mock()
+            util.set_log_level(util.LOG_SILENT)
+            try:
+                game.warn("Could not use {}", location)
+                game.can_spawn("PI", [13, 13])
+            finally:
+                util.set_log_level(util.LOG_WARNINGS)
+            self.assertFalse(debug.called, "Nothing should be printed while the log level is silent")
+            self.assertFalse(location.__format__.called, "Suppressed warnings should not be formatted")
+
+        game.game_map.add_unit("DF", [13, 13], 1)
+        self.assertEqual(game.get_attackers([13, 11], 0), game.get_attackers_unchecked([13, 11], 0), "Unchecked attackers should match")
+        self.assertEqual(game.game_map.get_locations_in_range([13, 4], 2), game.game_map.get_locations_in_range_unchecked([13, 4], 2), "Unchecked locations in range should match")
+        self.assertEqual(game.find_path_to_edge([13, 0]), game.find_path_to_edge_unchecked([13, 0]), "Unchecked path should match")
+
+    def test_bulk_spawning(self):
+        game = self.make_turn_0_map()
+        game._player_resources[0]['MP'] = 7.5
+        with mock.patch("gamelib.game_state.debug_write") as debug:
+            game.suppress_warnings(False)
+            self.assertEqual(7, game.attempt_spawn("PI", [13, 0], 1000), "Should spawn as many scouts as are affordable")
+        self.assertEqual(1, debug.call_count, "Running out of resources should be reported once")
+        self.assertIn("Not enough resources", debug.call_args[0][0], "Wrong reason for stopping")
+        self.assertEqual(0.5, game.get_resource(game.MP), "Resources should be spent for every scout")
+        self.assertEqual([("PI", 13, 0)] * 7, game._deploy_stack, "Deploy queue is wrong")
+        self.assertEqual(7, len(game.game_map[13, 0]), "Every scout should be on the map")
+
+        game._player_resources[0]['MP'] = 3
+        self.assertEqual(2, game.attempt_spawn("PI", [[13, 13], [14, 0], [13, 0]], 1), "Illegal locations should be skipped")
+        self.assertEqual(1, game.attempt_spawn("FF", [13, 2], 5), "Only one structure fits in a location")
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_can_spawn_many(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("FF", [14, 0], 0)
+        game.game_map.add_unit("PI", [13, 0], 0)
+        locations = [[13, 0], [14, 0], [13, 5], [14, 14], [0, 13], [-1, 3], [13.5, 2]]
+        self.assertEqual([True, False, False, False, True, False, False], game.can_spawn_many("SI", locations).tolist(), "Wrong legal locations for a mobile unit")
+        self.assertEqual([False, False, True, False, True, False, False], game.can_spawn_many("DF", locations).tolist(), "Wrong legal locations for a structure")
+        self.assertEqual([bool(game.can_spawn("DF", location)) for location in locations[:6]], game.can_spawn_many("DF", locations[:6]).tolist(), "can_spawn_many should match can_spawn")
+        game._player_resources[0]['MP'] = 0
+        self.assertFalse(game.can_spawn_many("SI", locations).any(), "Unaffordable units can not be spawned anywhere")
+
     def test_trivial_functions(self):
         game = self.make_turn_0_map()
 
@@ -275,3 +360,518 @@ class BasicTests(unittest.TestCase):
         actual = game.project_future_MP(turns)
         self.assertAlmostEqual(actual, expected, 0, "Expected {} MP {} turns from now, got {}".format(expected, turns, actual))
 
+    def test_path_cache(self):
+        game = self.make_turn_0_map()
+        path_finder = ShortestPathFinder(cache_size=2)
+        game.set_path_finder(path_finder)
+        open_path = game.find_path_to_edge([13, 0])
+        self.assertEqual(open_path, game.find_path_to_edge([13, 0]), "Cached path is different from the original path")
+        self.assertEqual(1, len(path_finder._path_cache), "Repeated pathing should hit the cache")
+
+        game.attempt_spawn("FF", [14, 1])
+        blocked_path = game.find_path_to_edge([13, 0])
+        self.assertNotIn([14, 1], blocked_path, "Cached path walks through a new structure")
+        self.assertEqual(ShortestPathFinder(cache_size=0).navigate_multiple_endpoints([13, 0], game.game_map.get_edge_locations(game.game_map.TOP_RIGHT), game), blocked_path, "Path was not recomputed after spawning")
+
+        game.game_map.remove_unit([14, 1])
+        self.assertEqual(open_path, game.find_path_to_edge([13, 0]), "Path was not updated after removing a unit")
+        game.find_path_to_edge([14, 0])
+        self.assertEqual(2, len(path_finder._path_cache), "Path cache grew past its size")
+
+    def test_find_paths_to_edge(self):
+        game = self.make_turn_0_map()
+        for x in range(0, 28):
+            if game.game_map.in_arena_bounds([x, 12]) and x != 20:
+                game.game_map.add_unit("FF", [x, 12])
+        game.game_map.add_unit("FF", [6, 7])
+        starts = [[13, 0], [14, 0], [6, 7], [20, 6], [3, 10], [24, 10]]
+        expected = [game.find_path_to_edge(location) for location in starts]
+        game.set_path_finder(ShortestPathFinder(cache_size=0))
+        self.assertEqual(expected, game.find_paths_to_edge(starts), "Batched paths differ from single paths")
+        self.assertIsNone(game.find_paths_to_edge(starts)[2], "Blocked start should not have a path")
+
+    def test_incremental_path_finder(self):
+        game = self.make_turn_0_map()
+        path_finder = ShortestPathFinder(cache_size=0, incremental=True)
+        game.set_path_finder(path_finder)
+        game.find_path_to_edge([13, 0])
+        for location in [[14, 1], [13, 3], [12, 5], [15, 5], [20, 11]]:
+            game.game_map.add_unit("FF", location)
+            expected = ShortestPathFinder(cache_size=0).navigate_multiple_endpoints([13, 0], game.game_map.get_edge_locations(game.game_map.TOP_RIGHT), game)
+            self.assertEqual(expected, game.find_path_to_edge([13, 0]), "Repaired path differs after placing at {}".format(location))
+            self.assertIsNotNone(path_finder._field, "Placing a single structure should not need a full search")
+            game.game_map.remove_unit(location)
+            expected = ShortestPathFinder(cache_size=0).navigate_multiple_endpoints([13, 0], game.game_map.get_edge_locations(game.game_map.TOP_RIGHT), game)
+            self.assertEqual(expected, game.find_path_to_edge([13, 0]), "Repaired path differs after removing {}".format(location))
+
+    def test_shared_workspace(self):
+        first = self.make_turn_0_map()
+        second = self.make_turn_0_map()
+        second.game_map.add_unit("FF", [14, 1])
+        first_finder = ShortestPathFinder(cache_size=0, incremental=True)
+        second_finder = ShortestPathFinder(cache_size=0, incremental=True)
+        first.set_path_finder(first_finder)
+        second.set_path_finder(second_finder)
+
+        first_path = first.find_path_to_edge([13, 0])
+        second_path = second.find_path_to_edge([13, 0])
+        self.assertIs(first_finder.workspace, second_finder.workspace, "Pathfinders should share the workspace of the arena")
+        self.assertIs(SearchWorkspace.for_arena(28), first_finder.workspace, "Workspace was not reused")
+        self.assertNotEqual(first_path, second_path, "Paths around different layouts should differ")
+        self.assertEqual(first_path, first.find_path_to_edge([13, 0]), "Path changed after another pathfinder used the workspace")
+        self.assertEqual(second_path, second.find_path_to_edge([13, 0]), "Path changed after another pathfinder used the workspace")
+
+    def test_topology(self):
+        game = self.make_turn_0_map()
+        topology = game.game_map.topology
+        self.assertEqual(420, topology.size, "The arena should have 420 locations")
+        self.assertEqual(420, len(list(game.game_map)), "Iterating the map should visit every location")
+        for index, location in enumerate(topology.index_location):
+            self.assertEqual(index, topology.index(location), "Index tables disagree at {}".format(location))
+        self.assertEqual(-1, topology.index([13, 27 + 1]), "Out of bounds location should not have an index")
+        self.assertEqual(((0, 14), (1, 13)), topology.neighbor_locations[0][13], "Neighbors should be in the arena and ordered up, down, right, left")
+        self.assertEqual(topology.edge_quadrant[topology.index([13, 0])], game.game_map.BOTTOM_LEFT, "[13, 0] should be on the bottom left edge")
+        self.assertEqual(-1, topology.edge_quadrant[topology.index([13, 13])], "[13, 13] should not be on an edge")
+
+    def test_structure_bitboard(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        self.assertEqual(0, game_map.get_structure_bitboard(), "An empty map should have no structures")
+        game_map.add_unit("FF", [13, 5], 0)
+        game_map.add_unit("DF", [14, 20], 1)
+        game_map.add_unit("PI", [14, 0], 0)
+        self.assertTrue(game_map.is_blocked([13, 5]), "Wall should block its location")
+        self.assertFalse(game_map.is_blocked([14, 0]), "Mobile units should not block")
+        self.assertEqual(1, game_map.count_structures(0), "I should have one structure")
+        self.assertEqual(2, game_map.count_structures(), "There should be two structures")
+        self.assertEqual([[13, 5], [14, 20]], game_map.bitboard_locations(game_map.get_structure_bitboard()), "Bitboard holds the wrong locations")
+
+        game_map.add_unit("FF", [14, 20], 0)
+        self.assertEqual(0, game_map.get_structure_bitboard(1), "Replaced enemy structure is still in its bitboard")
+        game_map.remove_unit([13, 5])
+        self.assertEqual([[14, 20]], game_map.bitboard_locations(game_map.get_structure_bitboard(0)), "Removed structure is still in the bitboard")
+
+    def test_evaluate_path_damage(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 6], 1)
+        path = [[13, 2], [13, 3], [13, 4], [13, 5]]
+        self.assertEqual(10.0, game.evaluate_path_damage(path, "PI"), "Scout should be hit once in each of the 2 locations in range")
+        self.assertEqual(40.0, game.evaluate_path_damage(path, "SI"), "Slower units should be hit once per frame")
+        self.assertEqual([0, 0, 5.0, 10.0], game.evaluate_path_damage(path, "PI", cumulative=True), "Wrong running totals")
+
+        game.game_map.add_unit("EF", [12, 2], 0)
+        shield = game.game_map[12, 2][0]
+        shield.shieldPerUnit = 3.0
+        shield.shieldRange = 1.5
+        self.assertEqual(7.0, game.evaluate_path_damage(path, "PI"), "Shield should only be counted once")
+        self.assertEqual(0, game.evaluate_path_damage(path, "PI", 1), "Enemy units should not be shielded by my structures")
+
+    def test_lazy_parsing(self):
+        config = self.make_turn_0_map().config
+        turn = """{"p2Units":[[],[],[[13,20,90.0,"2"]],[],[],[],[],[]],"turnInfo":[0,3,-1],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[[13,5,75.0,"1"]],[],[],[],[],[],[],[[13,5,75.0,"1"]]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        game = GameState(config, turn, lazy=True)
+        game.suppress_warnings(True)
+        self.assertIsNotNone(game._pending_units, "Units should not be parsed before game_map is used")
+        self.assertEqual(3, game.turn_number, "Turn number should be parsed right away")
+        self.assertEqual(12.0, game.get_resource(game.SP), "Resources should be parsed right away")
+        self.assertEqual(25.0, game.enemy_health, "Health should be parsed right away")
+        self.assertIsNotNone(game._pending_units, "Reading resources should not parse the units")
+
+        self.assertTrue(game.contains_stationary_unit([13, 5]), "Units should be parsed on first use of the map")
+        self.assertIsNone(game._pending_units, "Units should only be parsed once")
+        self.assertTrue(game.game_map[13, 5][0].upgraded, "Upgrades should be applied when the units are parsed")
+        self.assertEqual(1, game.game_map.count_structures(1), "Enemy units should be parsed")
+        self.assertFalse(game.game_map.enable_warnings, "Suppressed warnings should carry over to the parsed map")
+
+    def run_algo(self, algo, messages):
+        with mock.patch("gamelib.algocore.get_command", side_effect=messages), mock.patch("gamelib.algocore.debug_write"):
+            algo.start()
+
+    def test_decoded_messages(self):
+        config = self.make_turn_0_map().config
+        turn = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,3,-1],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[[13,5,75.0,"1"]],[],[],[],[],[],[]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        frame = """{"turnInfo":[1,3,0],"events":{"breach":[]}}"""
+        received = []
+
+        class Algo(AlgoCore):
+            def on_turn(self, turn_state):
+                received.append(turn_state)
+
+            def on_action_frame(self, frame_state):
+                received.append(frame_state)
+
+        algo = Algo()
+        self.run_algo(algo, [json.dumps(config), turn, frame, """{"turnInfo":[2,3,0]}"""])
+        self.assertEqual([turn, frame], received, "Messages should be passed as strings by default")
+
+        received.clear()
+        algo.decoded_messages = True
+        self.run_algo(algo, [json.dumps(config), turn, frame, """{"turnInfo":[2,3,0]}"""])
+        self.assertEqual([json.loads(turn), json.loads(frame)], received, "Messages should be passed as decoded dicts")
+
+        game = GameState.from_parsed(config, received[0])
+        self.assertEqual(3, game.turn_number, "GameState should read a decoded message")
+        self.assertTrue(game.contains_stationary_unit([13, 5]), "GameState should parse units from a decoded message")
+        self.assertIsNone(game.serialized_string, "There is no string for a decoded message")
+
+    def test_frame_subscription(self):
+        config = self.make_turn_0_map().config
+        quiet = """{"p1Stats":[30.0,1.0,2.0,0],"turnInfo":[1,3,0],"events":{"breach":[],"death":[[[1,2],3,"5",2,false]]}}"""
+        breach = """{"p1Stats":[29.0,1.0,2.0,0],"turnInfo":[1,3,1],"events":{"breach":[ [[13,27],1.0,3,"7",2] ],"death":[]}}"""
+        received = []
+
+        class Algo(AlgoCore):
+            def on_action_frame(self, frame_state):
+                received.append(frame_state)
+
+        algo = Algo()
+        algo.subscribe_frames(events=["breach"], fields=["p1Stats"])
+        self.run_algo(algo, [json.dumps(config), quiet, breach, """{"turnInfo":[2,3,0]}"""])
+        expected = {"turnInfo": [1, 3, 1], "p1Stats": [29.0, 1.0, 2.0, 0], "events": {"breach": [[[13, 27], 1.0, 3, "7", 2]]}}
+        self.assertEqual([expected], received, "Only the frame with a breach should be passed, with only the subscribed parts")
+
+        received.clear()
+        algo.subscribe_frames(fields=["p1Stats"])
+        self.run_algo(algo, [json.dumps(config), quiet, breach, """{"turnInfo":[2,3,0]}"""])
+        self.assertEqual([29.0, 1.0, 2.0, 0], received[1]["p1Stats"], "Every frame should be passed without an event subscription")
+        self.assertEqual(2, len(received), "Every frame should be passed without an event subscription")
+
+    def test_background_planning(self):
+        config = self.make_turn_0_map().config
+        frame = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[1,3,%d],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[[13,5,75.0,"1"]],[],[],[],[],[],[]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        turn = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,4,-1],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[],[],[],[],[],[],[]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        received = []
+
+        class Algo(AlgoCore):
+            def plan_next_turn(self, plan):
+                plan.cancelled.wait(5)
+                state = plan.predicted_state()
+                return state.turn_number, bool(state.contains_stationary_unit([13, 5])), plan.frame_count
+
+            def on_turn(self, turn_state):
+                received.append(self.background_result)
+
+        algo = Algo()
+        algo.background_planning = True
+        algo.background_timeout = 5
+        self.run_algo(algo, [json.dumps(config), frame % 0, frame % 1, turn, turn, """{"turnInfo":[2,4,0]}"""])
+        self.assertEqual([(4, True, 2), None], received, "on_turn should get the result planned during the action phase, and None without one")
+
+        # The frame has 12 SP and 30 MP, and the factory generates 1 SP per round on top of the 5 every player gets
+        factory_frame = frame.replace('[[13,5,75.0,"1"]],[]', '[],[[13,5,30.0,"1"]]') % 0
+        state = BackgroundPlan(config, factory_frame).predicted_state()
+        self.assertEqual((18.0, 30.0), (state.get_resource(state.SP), state.get_resource(state.SP, 1)), "SP should be projected for the next turn")
+
+        release = threading.Event()
+        plans = []
+
+        class Stubborn(AlgoCore):
+            def plan_next_turn(self, plan):
+                plans.append(plan)
+                plan.result = "partial"
+                release.wait(5)
+                return "late"
+
+            def on_turn(self, turn_state):
+                received.append(self.background_result)
+
+        received.clear()
+        algo = Stubborn()
+        algo.background_planning = True
+        algo.background_timeout = 0.05
+        messages = [json.dumps(config), frame % 0, turn, """{"turnInfo":[2,4,0]}"""]
+        with mock.patch("gamelib.algocore.get_command", side_effect=messages), mock.patch("gamelib.algocore.debug_write") as debug:
+            algo.start()
+        self.assertEqual(["partial"], received, "The result stored before the timeout should be used")
+        self.assertTrue(any("did not stop" in str(call) for call in debug.call_args_list), "Abandoning the worker should be logged")
+        release.set()
+        for i in range(100):
+            if not any(thread.name == "background-plan" for thread in threading.enumerate()):
+                break
+            time.sleep(0.01)
+        self.assertEqual("partial", plans[0].result, "An abandoned worker should not replace the result")
+
+    def test_turn_budget(self):
+        game = self.make_turn_0_map()
+        budget = TurnBudget(10)
+        self.assertTrue(budget.check(), "A new budget should have time left")
+        self.assertFalse(budget.check(reserve=20), "Reserve is larger than the budget")
+        self.assertTrue(9 < budget.remaining() <= 10, "Wrong time remaining")
+
+        game.attempt_spawn("FF", [13, 0])
+        budget.offer(game)
+        game.attempt_spawn("FF", [14, 0])
+        with mock.patch("gamelib.planning.send_command") as send:
+            game.turn_budget = budget
+            self.assertTrue(budget.submit(), "The first submit should send the turn")
+            game.submit_turn()
+        self.assertEqual([mock.call('[["FF", 13, 0]]'), mock.call("[]")], send.call_args_list, "Only the offered turn should be sent, once")
+        self.assertFalse(budget.check(), "No time should be left after submitting")
+
+        budget = TurnBudget(0.05)
+        with mock.patch("gamelib.planning.send_command") as send, mock.patch("gamelib.planning.debug_write"):
+            budget.start_watchdog(0.01)
+            for i in range(100):
+                if budget.submitted:
+                    break
+                time.sleep(0.01)
+        self.assertEqual([mock.call("[]"), mock.call("[]")], send.call_args_list, "The watchdog should submit an empty turn if none was offered")
+
+        budgets = []
+
+        class Algo(AlgoCore):
+            def on_turn(self, turn_state):
+                budgets.append(self.turn_budget)
+
+        config = self.make_turn_0_map().config
+        turn = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,4,-1],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[],[],[],[],[],[],[]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        self.run_algo(Algo(), [json.dumps(config), turn, """{"turnInfo":[2,4,0]}"""])
+        self.assertEqual(5.0, budgets[0].limit, "The budget should default to the soft time limit in the config")
+
+    def test_watchdog_then_submit_turn(self):
+        sent = []
+        budgets = []
+
+        class Algo(AlgoCore):
+            def on_turn(self, turn_state):
+                while not self.turn_budget.submitted:
+                    time.sleep(0.01)
+                game_state = GameState(self.config, turn_state, turn_budget=self.turn_budget)
+                game_state.attempt_spawn("FF", [13, 0])
+                game_state.submit_turn()
+                budgets.append(GameState(self.config, turn_state).turn_budget)
+
+        algo = Algo()
+        algo.turn_watchdog = True
+        algo.turn_time_limit = 0.05
+        algo.watchdog_margin = 0.01
+        config = self.make_turn_0_map().config
+        turn = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,4,-1],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[],[],[],[],[],[],[]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        with mock.patch("gamelib.planning.send_command", side_effect=sent.append), mock.patch("gamelib.game_state.send_command", side_effect=sent.append), mock.patch("gamelib.planning.debug_write"):
+            self.run_algo(algo, [json.dumps(config), turn, """{"turnInfo":[2,4,0]}"""])
+        self.assertEqual(["[]", "[]"], sent, "The turn submitted by the watchdog should be the only one sent")
+        self.assertEqual([None], budgets, "Only GameStates given the budget should use it")
+
+    def test_fork(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 5], 0)
+        game.game_map.add_unit("DF", [14, 20], 1)
+        turret = game.game_map[13, 5][0]
+
+        child = game.fork()
+        self.assertIs(turret, child.game_map[13, 5][0], "Fork should share unchanged units")
+        child.attempt_spawn("FF", [12, 5])
+        child.attempt_upgrade([13, 5])
+        child.game_map.remove_unit([14, 20])
+        self.assertTrue(child.contains_stationary_unit([12, 5]), "Fork should have its new wall")
+        self.assertTrue(child.game_map[13, 5][0].upgraded, "Fork should have its upgraded turret")
+        self.assertEqual(0, child.game_map.count_structures(1), "Fork should have no enemy structures left")
+        self.assertEqual([("FF", 12, 5), ("UP", 13, 5)], child._build_stack, "Fork should plan its own turn")
+
+        self.assertFalse(game.contains_stationary_unit([12, 5]), "Spawning in the fork should not change the parent")
+        self.assertFalse(turret.upgraded, "Upgrading in the fork should not change the parent's unit")
+        self.assertEqual(1, game.game_map.count_structures(1), "Removing in the fork should not change the parent")
+        self.assertEqual([], game._build_stack, "The fork's turn should not be added to the parent's")
+        self.assertEqual(25.0, game.get_resource(game.SP), "Resources spent in the fork should not be spent in the parent")
+        self.assertEqual(1, len(game.get_attackers([14, 18], 0)), "The parent's coverage should not change")
+        self.assertEqual(0, len(child.get_attackers([14, 18], 0)), "The fork's coverage should follow its own map")
+
+        game.game_map.add_unit("FF", [10, 5], 0)
+        self.assertFalse(child.contains_stationary_unit([10, 5]), "Changing the parent should not change the fork")
+
+    def test_fork_can_not_submit(self):
+        game = self.make_turn_0_map()
+        game.turn_budget = TurnBudget(10)
+        child = game.fork()
+        child.attempt_spawn("FF", [13, 0])
+        self.assertIsNone(child.turn_budget, "Fork should not share the turn budget")
+        with mock.patch("gamelib.game_state.send_command") as send, mock.patch("gamelib.planning.send_command") as budget_send:
+            child.submit_turn()
+            child.fork().submit_turn()
+        self.assertFalse(send.called or budget_send.called, "A fork should not submit a turn")
+        self.assertFalse(game.turn_budget.submitted, "A fork should not use up the turn budget")
+
+    def test_rollback(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 5], 0)
+        turret = game.game_map[13, 5][0]
+        self.assertEqual(1, len(game.get_attackers([13, 7], 1)), "The turret should attack enemy units in range")
+
+        savepoint = game.savepoint()
+        game.attempt_spawn("DF", [12, 5])
+        game.attempt_upgrade([13, 5])
+        game.attempt_spawn("PI", [13, 0], 2)
+        inner = game.savepoint()
+        game.game_map.remove_unit([12, 5])
+        game.rollback(inner)
+        self.assertTrue(game.contains_stationary_unit([12, 5]), "Rolling back to the inner savepoint should restore the turret")
+        game.release(inner)
+
+        self.assertEqual(2, len(game.get_attackers([13, 7], 1)), "Both turrets should attack inside the savepoint")
+        game.rollback(savepoint)
+        game.release(savepoint)
+        self.assertFalse(game.contains_stationary_unit([12, 5]), "Spawned turret should be removed")
+        self.assertIs(turret, game.game_map[13, 5][0], "Upgraded turret should be restored")
+        self.assertFalse(turret.upgraded, "Turret should not be upgraded")
+        self.assertEqual([], game.game_map[13, 0], "Spawned mobile units should be removed")
+        self.assertEqual([25.0, 5.0], game.get_resources(), "Resources should be restored")
+        self.assertEqual(([], []), (game._build_stack, game._deploy_stack), "Planned turn should be restored")
+        self.assertEqual(1, game.game_map.count_structures(0), "Structure bitboard should be restored")
+        self.assertEqual(1, len(game.get_attackers([13, 7], 1)), "Coverage should be rebuilt after rolling back")
+        self.assertIsNone(game.game_map._journal, "Recording should stop when the last savepoint is released")
+
+        with self.assertRaises(ValueError):
+            with game.transaction():
+                game.attempt_spawn("FF", [12, 5])
+                raise ValueError()
+        self.assertFalse(game.contains_stationary_unit([12, 5]), "A failed transaction should be rolled back")
+        with game.transaction():
+            game.attempt_spawn("FF", [12, 5])
+        self.assertTrue(game.contains_stationary_unit([12, 5]), "A finished transaction should be kept")
+
+    def test_unit_templates(self):
+        game = self.make_turn_0_map()
+        first = GameUnit("DF", game.config, 0, None, 13, 5)
+        second = GameUnit("DF", game.config, 1, None, 14, 20)
+        self.assertIs(first._template, second._template, "Units of a type should share a template")
+        self.assertFalse(hasattr(first, "__dict__"), "Units should not have a __dict__")
+        self.assertEqual((90.0, 2.5, [2.0, 0]), (first.health, first.attackRange, first.cost), "Wrong stats from the template")
+
+        first.upgrade()
+        self.assertEqual((15.0, 3.5, [6.0, 0]), (first.damage_i, first.attackRange, first.cost), "Wrong upgraded stats")
+        self.assertEqual(2.5, second.attackRange, "Upgrading a unit should not change the others")
+
+        second.shieldPerUnit = 3.0
+        self.assertEqual(3.0, second.shieldPerUnit, "Units should keep stats set on them")
+        self.assertEqual(0, GameUnit("DF", game.config).shieldPerUnit, "Setting a stat should not change the template")
+
+        third = GameUnit("DF", game.config)
+        third.cost[0] = 3.0
+        self.assertEqual([3.0, 0], third.cost, "Changes made to cost in place should be kept")
+        third.upgrade()
+        self.assertEqual([7.0, 0], third.cost, "Upgrading should add the upgrade cost to the unit's own cost")
+        self.assertEqual([2.0, 0], GameUnit("DF", game.config).cost, "Changing a unit's cost should not change the template")
+        third.config = dict(game.config)
+        self.assertIsNot(game.config, third.config, "config should be settable")
+
+    def test_unit_type_registry(self):
+        game = self.make_turn_0_map()
+        unit_types = get_unit_type_registry(game.config)
+        self.assertIs(unit_types, game.unit_types, "GameState should use the registry of its config")
+        self.assertIs(unit_types, get_unit_type_registry(game.config), "The registry should be built once per config")
+        self.assertEqual(("FF", "DF", "SI", "UP"), (unit_types.WALL, unit_types.TURRET, unit_types.INTERCEPTOR, unit_types.UPGRADE), "Wrong unit type constants")
+        self.assertEqual(2, unit_types.type_id("DF"), "Wrong type id")
+        self.assertTrue(unit_types.stationary[unit_types.type_id("EF")], "Factory should be a structure")
+        self.assertFalse(unit_types.is_stationary("PI"), "Scout should not be a structure")
+        self.assertFalse(unit_types.is_unit("RM"), "Remove is not a unit")
+        self.assertEqual(([2.0, 0], [4.0, 0], [0, 1.0]), (unit_types.cost("DF"), unit_types.cost("DF", True), unit_types.cost("PI", True)), "Wrong costs")
+        self.assertEqual(unit_types.cost("DF", True), game.type_cost("DF", True), "type_cost should match the registry")
+        self.assertTrue(unit_types.can_upgrade("FF"), "Walls can be upgraded")
+        self.assertFalse(unit_types.can_upgrade("PI"), "Scouts can not be upgraded")
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_unit_store(self):
+        config = self.make_turn_0_map().config
+        turn = """{"p2Units":[[[13,20,60.0,"3"]],[],[[13,21,90.0,"2"]],[],[],[],[],[]],"turnInfo":[0,3,-1],"p1Stats":[30.0,12.0,7.0,0],"p1Units":[[[13,5,75.0,"1"]],[],[],[],[],[],[],[[13,5,75.0,"1"]]],"p2Stats":[25.0,25.0,5.0,0],"events":{}}"""
+        game = GameState(config, turn)
+        store = game.game_map.get_unit_store()
+        self.assertEqual(3, len(store), "Every unit should be in the store")
+        self.assertEqual([1, 3, 2], store.unit_id.tolist(), "Units should be ordered by column then row, with their engine ids")
+        self.assertEqual(90.0, store.total_health(player_index=1, unit_type="DF"), "Wrong enemy turret health")
+        self.assertEqual(2, store.count(player_index=1, stationary=True), "Wrong enemy structure count")
+        self.assertEqual([1, 1], store.count_by_row(player_index=1)[20:22].tolist(), "Wrong structures per row")
+        self.assertTrue(store.upgraded[0], "Upgrades should be stored")
+        self.assertIs(store, game.game_map.get_unit_store(), "Store should be cached while the map is unchanged")
+
+        game.game_map.add_unit("PI", [13, 0], 0)
+        store = game.game_map.get_unit_store()
+        self.assertEqual([[13, 0]], store.locations(stationary=False), "Store should follow changes to the map")
+        self.assertEqual(-1, store.unit_id[store.mask(unit_type="PI")][0], "Units added by the map have no engine id")
+        self.assertEqual(game.game_map[13, 5], store.select(store.mask(player_index=0, stationary=True)), "select should give back the units")
+
+    def test_map_iteration(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        locations = list(game_map)
+        self.assertEqual(420, len(locations), "Iteration should visit every location in the arena")
+        self.assertEqual(([13, 0], [14, 27]), (locations[0], locations[-1]), "Iteration should go row by row from the bottom")
+        self.assertEqual(420 * 420, sum(1 for outer in game_map for inner in game_map), "Nested iterations should not interfere")
+
+        game_map.add_unit("FF", [13, 13], 1)
+        game_map.add_unit("DF", [3, 13], 0)
+        game_map.add_unit("PI", [13, 0], 0)
+        self.assertEqual([[13, 0], [3, 13], [13, 13]], list(game_map.iter_occupied()), "Wrong occupied locations")
+        self.assertEqual([[3, 13], [13, 13]], list(game_map.iter_structures()), "Wrong structure locations")
+        self.assertEqual([[13, 13]], list(game_map.iter_structures(1)), "Wrong enemy structure locations")
+        game_map.remove_unit([13, 0])
+        self.assertEqual([[3, 13], [13, 13]], list(game_map.iter_occupied()), "Removed units should not be visited")
+
+    def test_map_cells_changed_directly(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        self.assertEqual([], game_map[13, 13], "Empty locations should hold an empty list")
+        wall = GameUnit("FF", game.config, 0, None, 13, 13)
+        version = game_map.version
+        game_map[13, 13].append(wall)
+        self.assertTrue(wall in game_map[13, 13], "Appended units should be on the map")
+        self.assertEqual([[13, 13]], list(game_map.iter_structures(0)), "Appending should update the structure bitboard")
+        self.assertFalse(game.can_spawn("FF", [13, 13]), "Appending a structure should block the location")
+        self.assertGreater(game_map.version, version, "Appending should increase the version")
+
+        savepoint = game.savepoint()
+        game_map[13, 13].remove(wall)
+        self.assertEqual([], list(game_map.iter_occupied()), "Removing should update the occupied bitboard")
+        self.assertTrue(game.can_spawn("FF", [13, 13]), "Removing a structure should free the location")
+        game.rollback(savepoint)
+        self.assertEqual([wall], game_map[13, 13], "Rollback should undo direct changes")
+        self.assertTrue(game_map.is_blocked([13, 13]), "Rollback should restore the bitboards")
+
+        fork = game.fork()
+        fork.game_map[13, 13].clear()
+        self.assertFalse(fork.game_map.is_blocked([13, 13]), "Clearing should update the fork's bitboards")
+        self.assertEqual([wall], game_map[13, 13], "Direct changes to a fork should not change the original")
+        self.assertTrue(game_map.is_blocked([13, 13]), "Direct changes to a fork should not change the original bitboards")
+
+        copied = copy.deepcopy(game_map)
+        copied[13, 13].pop()
+        self.assertFalse(copied.is_blocked([13, 13]), "Lists of a deep copy should update the copy")
+        self.assertTrue(game_map.is_blocked([13, 13]), "Lists of a deep copy should not update the original")
+
+    def test_locations_in_range(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        expected = [[12, 4], [13, 3], [13, 4], [13, 5], [14, 4]]
+        self.assertEqual(expected, game_map.get_locations_in_range([13, 4], 1), "Wrong locations in range")
+        self.assertEqual(expected, game_map.get_locations_in_range([13, 4], 1), "Memoized locations in range changed")
+        self.assertEqual([[13, 0], [13, 1], [14, 0]], game_map.get_locations_in_range([13, 0], 1), "Locations in range should stay in the arena")
+
+        indices = game_map.get_location_indices_in_range([13, 4], 1)
+        self.assertEqual(expected, [list(game_map.topology.index_location[index]) for index in indices], "Indices should match the locations in range")
+        mask = game_map.get_range_mask([13, 4], 1)
+        self.assertEqual(sorted(indices), list(iter_bits(mask)), "Mask should hold the locations in range")
+
+    def test_coverage_map(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 13], 1)
+        game.game_map.add_unit("DF", [14, 14], 0)
+        coverage = game.get_coverage_map(0)
+        self.assertEqual(1, coverage.get_count([13, 11]), "Turret should cover a location 2 away")
+        self.assertEqual(0, coverage.get_count([13, 9]), "Turret should not cover a location 4 away")
+        self.assertEqual(5.0, coverage.get_damage([13, 11]), "Damage should be the turret's damage to mobile units")
+        self.assertIs(coverage, game.get_coverage_map(0), "Coverage map should be cached while the map is unchanged")
+
+        turret = game.game_map[13, 13][0]
+        self.assertEqual([turret], game.get_attackers([13, 11], 0), "get_attackers should find the enemy turret")
+        game.game_map._upgrade_unit(turret)
+        self.assertEqual(1, game.get_coverage_map(0).get_count([13, 10]), "Upgraded turret should cover a location 3 away")
+        game.game_map.remove_unit([13, 13])
+        self.assertEqual([], game.get_attackers([13, 11], 0), "Removed turret should not attack")
+
+        coverage = game.get_coverage_map(0)
+        game.game_map.add_unit("DF", [12, 14], 1)
+        game.game_map.add_unit("PI", [13, 14], 1)
+        game.game_map[14, 15].append(GameUnit("DF", game.config, 1, None, 14, 15))
+        self.assertIs(coverage, game.get_coverage_map(0), "A few changes should update the coverage map instead of replacing it")
+        fresh = CoverageMap(game.game_map, 0, coverage.search_range)
+        self.assertEqual(fresh.attackers, coverage.attackers, "Updated attackers should match a fresh coverage map, in the same order")
+        self.assertEqual((fresh.count, fresh.damage), (coverage.count, coverage.damage), "Updated counts should match a fresh coverage map")
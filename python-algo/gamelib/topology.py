@@ -0,0 +1,214 @@
+import math
+
+_topologies = {}
+
+
+def popcount(bitboard):
+    """Counts the bits set in a bitboard
+    """
+    return bin(bitboard).count("1")
+
+
+def iter_bits(bitboard):
+    """Iterates over the indices of the bits set in a bitboard, lowest first
+    """
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+def get_topology(arena_size):
+    """Gets the ArenaTopology for an arena size, building it on first use
+
+    Args:
+        arena_size: The size of the arena
+
+    Returns:
+        The shared ArenaTopology for that size
+
+    """
+    if arena_size not in _topologies:
+        _topologies[arena_size] = ArenaTopology(arena_size)
+    return _topologies[arena_size]
+
+
+class ArenaTopology:
+    """Precomputed layout of the diamond shaped arena
+
+    Every in-arena location is given an index, counting up row by row from the bottom.
+    The tables are built once per arena size and are never modified, so they can be
+    shared by every GameMap and pathfinder. Use get_topology to get one.
+
+    Attributes :
+        * ARENA_SIZE (int): The size of the arena
+        * HALF_ARENA (int): Half of the size of the arena
+        * size (int): The number of in-arena locations
+        * index_location (tuple): index_location[i] is the (x, y) location with index i
+        * location_index (list): location_index[x][y] is the index of [x, y], or -1 if it is out of the arena
+        * locations (frozenset): Every in-arena (x, y) location
+        * neighbors (tuple): neighbors[i] holds the indices of the in-arena neighbors of i, in the order up, down, right, left
+        * neighbor_locations (list): neighbor_locations[x][y] holds the in-arena neighbors of [x, y] as (x, y) tuples, in the same order
+        * edges (tuple): The indices along each edge, ordered like GameMap.get_edges: top_right, top_left, bottom_left, bottom_right
+        * edge_quadrant (tuple): edge_quadrant[i] is the edge index i lies on, or -1 if it is not on an edge
+        * territory_masks (tuple): territory_masks[p] is a bitboard of the half of the arena player p can build structures in
+        * spawn_masks (tuple): spawn_masks[p] is a bitboard of the edge locations player p can deploy mobile units on
+
+    """
+    def __init__(self, arena_size):
+        self.ARENA_SIZE = arena_size
+        self.HALF_ARENA = int(arena_size / 2)
+
+        index_location = []
+        self.location_index = [[-1] * arena_size for x in range(arena_size)]
+        for y in range(arena_size):
+            for x in range(arena_size):
+                if self.__in_diamond(x, y):
+                    self.location_index[x][y] = len(index_location)
+                    index_location.append((x, y))
+        self.index_location = tuple(index_location)
+        self.size = len(self.index_location)
+        self.locations = frozenset(self.index_location)
+
+        neighbors = []
+        self.neighbor_locations = [[() for y in range(arena_size)] for x in range(arena_size)]
+        for x, y in self.index_location:
+            adjacent = tuple(location for location in ((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)) if location in self.locations)
+            self.neighbor_locations[x][y] = adjacent
+            neighbors.append(tuple(self.location_index[nx][ny] for nx, ny in adjacent))
+        self.neighbors = tuple(neighbors)
+
+        half = self.HALF_ARENA
+        last = arena_size - 1
+        top_right = tuple(self.location_index[half + num][last - num] for num in range(half))
+        top_left = tuple(self.location_index[half - 1 - num][last - num] for num in range(half))
+        bottom_left = tuple(self.location_index[half - 1 - num][num] for num in range(half))
+        bottom_right = tuple(self.location_index[half + num][num] for num in range(half))
+        self.edges = (top_right, top_left, bottom_left, bottom_right)
+        edge_quadrant = [-1] * self.size
+        for quadrant, edge in enumerate(self.edges):
+            for index in edge:
+                edge_quadrant[index] = quadrant
+        self.edge_quadrant = tuple(edge_quadrant)
+
+        bottom_half = 0
+        for index, (x, y) in enumerate(self.index_location):
+            if y < self.HALF_ARENA:
+                bottom_half |= 1 << index
+        everywhere = (1 << self.size) - 1
+        self.territory_masks = (bottom_half, everywhere & ~bottom_half)
+        self.spawn_masks = (self.__edge_mask(bottom_left) | self.__edge_mask(bottom_right),
+                            self.__edge_mask(top_right) | self.__edge_mask(top_left))
+
+        self.__range_offsets = {}
+        self.__ranges = {}
+        self.__range_masks = {}
+
+    @staticmethod
+    def __edge_mask(edge):
+        mask = 0
+        for index in edge:
+            mask |= 1 << index
+        return mask
+
+    def __in_diamond(self, x, y):
+        half_board = self.HALF_ARENA
+        if y < half_board:
+            row_size = y + 1
+        else:
+            row_size = self.ARENA_SIZE - y
+        startx = half_board - row_size
+        endx = startx + (2 * row_size) - 1
+        return startx <= x <= endx
+
+    def index(self, location):
+        """Gets the index of a location
+
+        Args:
+            location: A map location
+
+        Returns:
+            The index of the location, or -1 if it is not in the arena
+
+        """
+        x, y = location
+        if (x, y) not in self.locations:
+            return -1
+        return self.location_index[int(x)][int(y)]
+
+    def in_bounds(self, location):
+        """Checks if a location is inside the arena
+
+        Args:
+            location: A map location
+
+        Returns:
+            True if the location is on the board, False otherwise
+
+        """
+        x, y = location
+        return (x, y) in self.locations
+
+    def range_offsets(self, radius, hit_radius):
+        """Gets the offsets of the locations whose centers are closer than radius + hit_radius
+
+        Args:
+            radius: The radius of the search area
+            hit_radius: The get hit radius of units in the game config
+
+        Returns:
+            A tuple of (dx, dy) offsets, ordered by dx then dy
+
+        """
+        key = (radius, hit_radius)
+        offsets = self.__range_offsets.get(key)
+        if offsets is None:
+            search_radius = math.ceil(radius)
+            offsets = tuple((dx, dy) for dx in range(-search_radius, search_radius + 1) for dy in range(-search_radius, search_radius + 1)
+                            if math.sqrt(dx ** 2 + dy ** 2) < radius + hit_radius)
+            self.__range_offsets[key] = offsets
+        return offsets
+
+    def indices_in_range(self, index, radius, hit_radius):
+        """Gets the in-arena locations whose centers are closer than radius + hit_radius to a location
+
+        Results are memoized, so later calls with the same arguments are a dictionary lookup.
+
+        Args:
+            index: The index of the center of the search area
+            radius: The radius of the search area
+            hit_radius: The get hit radius of units in the game config
+
+        Returns:
+            A tuple of indices, ordered by x then y like GameMap.get_locations_in_range
+
+        """
+        key = (index, radius, hit_radius)
+        indices = self.__ranges.get(key)
+        if indices is None:
+            x, y = self.index_location[index]
+            indices = tuple(self.location_index[x + dx][y + dy] for dx, dy in self.range_offsets(radius, hit_radius)
+                            if (x + dx, y + dy) in self.locations)
+            self.__ranges[key] = indices
+        return indices
+
+    def range_mask(self, index, radius, hit_radius):
+        """Gets indices_in_range as a bitboard
+
+        Args:
+            index: The index of the center of the search area
+            radius: The radius of the search area
+            hit_radius: The get hit radius of units in the game config
+
+        Returns:
+            An int with the bit of every location in range set
+
+        """
+        key = (index, radius, hit_radius)
+        mask = self.__range_masks.get(key)
+        if mask is None:
+            mask = 0
+            for in_range in self.indices_in_range(index, radius, hit_radius):
+                mask |= 1 << in_range
+            self.__range_masks[key] = mask
+        return mask
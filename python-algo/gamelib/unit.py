@@ -1,3 +1,6 @@
+from collections import namedtuple
+
+
 def is_stationary(unit_type, structure_types):
     """
         Args:
@@ -9,9 +12,78 @@ def is_stationary(unit_type, structure_types):
     return unit_type in structure_types
 
 
+_templates = {}
+
+
+class UnitTemplate(namedtuple("UnitTemplate", ["unit_type", "config", "stationary", "speed", "damage_f", "damage_i",
+                                               "attackRange", "shieldRange", "max_health", "shieldPerUnit", "cost"])):
+    """The stats shared by every unit of a type, built once per config. See GameUnit for the fields
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, unit_type, config, type_config):
+        return cls(unit_type, config, type_config["unitCategory"] == 0, type_config.get("speed", 0),
+                   type_config.get("attackDamageTower", 0), type_config.get("attackDamageWalker", 0),
+                   type_config.get("attackRange", 0), type_config.get("shieldRange", 0), type_config.get("startHealth", 0),
+                   type_config.get("shieldPerUnit", 0), (type_config.get("cost1", 0), type_config.get("cost2", 0)))
+
+    def upgraded(self, type_config):
+        """Gets the template with the upgrade of type_config applied on top of this one
+        """
+        upgrade = type_config.get("upgrade", {})
+        return self._replace(
+            speed=upgrade.get("speed", self.speed),
+            damage_f=upgrade.get("attackDamageTower", self.damage_f),
+            damage_i=upgrade.get("attackDamageWalker", self.damage_i),
+            attackRange=upgrade.get("attackRange", self.attackRange),
+            shieldRange=upgrade.get("shieldRange", self.shieldRange),
+            max_health=upgrade.get("startHealth", self.max_health),
+            shieldPerUnit=upgrade.get("shieldPerUnit", self.shieldPerUnit),
+            cost=(upgrade.get("cost1", 0) + self.cost[0], upgrade.get("cost2", 0) + self.cost[1]))
+
+
+def get_unit_templates(config):
+    """Gets the templates of every unit type in a config, building them on first use
+
+    Args:
+        config: Contains information about the game
+
+    Returns:
+        A dict from each unit type to a tuple of its type config, its template and its upgraded template
+
+    """
+    cached = _templates.get(id(config))
+    if cached is None or cached[0] is not config:
+        table = {}
+        for type_config in config["unitInformation"]:
+            if "unitCategory" in type_config:
+                base = UnitTemplate.from_config(type_config["shorthand"], config, type_config)
+                table[type_config["shorthand"]] = (type_config, base, base.upgraded(type_config))
+        cached = (config, table)
+        _templates[id(config)] = cached
+    return cached[1]
+
+
+def _template_property(name):
+    def get(self):
+        return getattr(self._template, name)
+
+    def set(self, value):
+        # Changing a stat gives this unit its own copy of the template
+        self._template = self._template._replace(**{name: value})
+
+    return property(get, set)
+
+
 class GameUnit:
     """Holds information about a Unit. 
 
+    The stats of a unit come from a UnitTemplate shared by every unit of the same type,
+    so units only store their own position, owner, health and flags. Setting a stat gives
+    the unit its own copy of the template. cost is a list of the unit's own, made from the
+    template the first time it is read, so it can be changed in place.
+
     Attributes :
         * unit_type (string): This unit's type
         * config (JSON): Contains information about the game
@@ -30,9 +102,12 @@ class GameUnit:
         * shieldPerUnit (float): how much shield is given per unit
         * pending_removal (boolean): If this unit is marked for removal by its owner
         * upgraded (boolean): If this unit is upgraded
+        * unit_id (string): The id the game engine gave this unit, or None if it was not created by parsing the game state
 
     """
-    def __init__(self, unit_type, config, player_index=None, health=None, x=-1, y=-1):
+    __slots__ = ("unit_type", "config", "player_index", "pending_removal", "upgraded", "x", "y", "health", "unit_id", "_template", "_cost")
+
+    def __init__(self, unit_type, config, player_index=None, health=None, x=-1, y=-1, unit_id=None):
         """ Initialize unit variables using args passed
 
         """
@@ -43,37 +118,38 @@ class GameUnit:
         self.upgraded = False
         self.x = x
         self.y = y
-        self.__serialize_type()
+        self.unit_id = unit_id
+        self._template = get_unit_templates(config)[unit_type][1]
+        self._cost = None
         self.health = self.max_health if not health else health
 
-    def __serialize_type(self):
-        from .game_state import STRUCTURE_TYPES, UNIT_TYPE_TO_INDEX, FACTORY
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]]
-        self.stationary = type_config["unitCategory"] == 0
-        self.speed = type_config.get("speed", 0)
-        self.damage_f = type_config.get("attackDamageTower", 0)
-        self.damage_i = type_config.get("attackDamageWalker", 0)
-        self.attackRange = type_config.get("attackRange", 0)
-        self.shieldRange = type_config.get("shieldRange", 0)
-        self.max_health = type_config.get("startHealth", 0)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", 0)
-        self.cost = [type_config.get("cost1", 0), type_config.get("cost2", 0)]
+    stationary = _template_property("stationary")
+    speed = _template_property("speed")
+    damage_f = _template_property("damage_f")
+    damage_i = _template_property("damage_i")
+    attackRange = _template_property("attackRange")
+    shieldRange = _template_property("shieldRange")
+    max_health = _template_property("max_health")
+    shieldPerUnit = _template_property("shieldPerUnit")
+
+    @property
+    def cost(self):
+        if self._cost is None:
+            self._cost = list(self._template.cost)
+        return self._cost
 
+    @cost.setter
+    def cost(self, cost):
+        self._cost = cost
 
     def upgrade(self):
-        from .game_state import UNIT_TYPE_TO_INDEX
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]].get("upgrade", {})
-        self.speed = type_config.get("speed", self.speed)
-        self.damage_f = type_config.get("attackDamageTower", self.damage_f)
-        self.damage_i = type_config.get("attackDamageWalker", self.damage_i)
-        self.attackRange = type_config.get("attackRange", self.attackRange)
-        self.shieldRange = type_config.get("shieldRange", self.shieldRange)
-        self.max_health = type_config.get("startHealth", self.max_health)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", self.shieldPerUnit)
-        self.cost = [type_config.get("cost1", 0) + self.cost[0], type_config.get("cost2", 0) + self.cost[1]]
+        type_config, base, upgraded = get_unit_templates(self.config)[self.unit_type]
+        if self._cost is not None:
+            upgrade = type_config.get("upgrade", {})
+            self._cost = [upgrade.get("cost1", 0) + self._cost[0], upgrade.get("cost2", 0) + self._cost[1]]
+        self._template = upgraded if self._template is base else self._template.upgraded(type_config)
         self.upgraded = True
 
-
     def __toString(self):
         owner = "Friendly" if self.player_index == 0 else "Enemy"
         removal = ", pending removal" if self.pending_removal else ""
@@ -0,0 +1,158 @@
+from .unit_types import get_unit_type_registry
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class UnitStore:
+    """The units of a GameMap as parallel numpy arrays, one entry per unit
+
+    Entry i of every array describes units[i]. Units are stored column by column, then by y,
+    then in the order they are listed at their location, like a scan over game_map[x, y].
+    Use GameMap.get_unit_store to get one. The map rebuilds it when its version changes, so it
+    follows add_unit, remove_unit, upgrades and changes to the lists of game_map[x, y], but not changes
+    made directly to a GameUnit's health or pending_removal.
+
+    Requires numpy.
+
+    Attributes :
+        * game_map (:obj: GameMap): The map the store was built from
+        * version (int): The GameMap version the store was built from
+        * units (list): The GameUnits, in the order of the arrays
+        * type_id (array): The UnitTypeRegistry id of each unit's type
+        * player_index (array): The owner of each unit, 0 for you 1 for the enemy
+        * x (array): The x coordinate of each unit
+        * y (array): The y coordinate of each unit
+        * health (array): The health of each unit
+        * upgraded (array): If each unit is upgraded
+        * pending_removal (array): If each unit will be removed at the end of the turn
+        * unit_id (array): The id the game engine gave each unit, or -1 if it has none
+        * stationary (array): If each unit is a structure
+
+    """
+    def __init__(self, game_map):
+        """Builds the arrays from the units on a map
+
+        Args:
+            game_map: The GameMap to read units from
+
+        """
+        if np is None:
+            raise ImportError("UnitStore requires numpy.")
+        self.game_map = game_map
+        self.version = game_map.version
+        registry = get_unit_type_registry(game_map.config)
+
+        units = []
+        location_index = game_map.topology.location_index
+        for x in range(game_map.ARENA_SIZE):
+            for y in range(game_map.ARENA_SIZE):
+                if location_index[x][y] >= 0:
+                    units.extend(game_map._units_at(x, y))
+        self.units = units
+
+        self.type_id = np.array([registry.type_id(unit.unit_type) for unit in units], dtype=np.int8)
+        self.player_index = np.array([unit.player_index for unit in units], dtype=np.int8)
+        self.x = np.array([unit.x for unit in units], dtype=np.int16)
+        self.y = np.array([unit.y for unit in units], dtype=np.int16)
+        self.health = np.array([unit.health for unit in units], dtype=np.float64)
+        self.upgraded = np.array([unit.upgraded for unit in units], dtype=bool)
+        self.pending_removal = np.array([unit.pending_removal for unit in units], dtype=bool)
+        self.unit_id = np.array([self.__engine_id(unit.unit_id) for unit in units], dtype=np.int64)
+        self.stationary = np.array([registry.is_stationary(unit.unit_type) for unit in units], dtype=bool)
+        self.__registry = registry
+
+    @staticmethod
+    def __engine_id(unit_id):
+        try:
+            return int(unit_id)
+        except (TypeError, ValueError):
+            return -1
+
+    def __len__(self):
+        return len(self.units)
+
+    def mask(self, player_index=None, unit_type=None, stationary=None, pending_removal=None):
+        """Selects the units matching some filters. Filters left as None are not applied
+
+        Args:
+            player_index: 0 for your units, 1 for the enemy's
+            unit_type: A unit type, or a list of unit types
+            stationary: True for structures, False for mobile units
+            pending_removal: True for units that will be removed, False for the others
+
+        Returns:
+            A boolean array, True for each matching unit
+
+        """
+        selected = np.ones(len(self.units), dtype=bool)
+        if player_index is not None:
+            selected &= self.player_index == player_index
+        if unit_type is not None:
+            unit_types = [unit_type] if isinstance(unit_type, str) else unit_type
+            selected &= np.isin(self.type_id, [self.__registry.type_id(each) for each in unit_types])
+        if stationary is not None:
+            selected &= self.stationary == bool(stationary)
+        if pending_removal is not None:
+            selected &= self.pending_removal == bool(pending_removal)
+        return selected
+
+    def count(self, **filters):
+        """Counts the units matching the filters of mask
+
+        Returns:
+            The number of matching units
+
+        """
+        return int(np.count_nonzero(self.mask(**filters)))
+
+    def total_health(self, **filters):
+        """Sums the health of the units matching the filters of mask
+
+        Returns:
+            The summed health of the matching units
+
+        """
+        return float(self.health[self.mask(**filters)].sum())
+
+    def count_by_row(self, **filters):
+        """Counts the units matching the filters of mask in each row of the arena
+
+        Returns:
+            An array where entry y is the number of matching units with that y coordinate
+
+        """
+        return np.bincount(self.y[self.mask(**filters)], minlength=self.game_map.ARENA_SIZE)
+
+    def count_by_column(self, **filters):
+        """Counts the units matching the filters of mask in each column of the arena
+
+        Returns:
+            An array where entry x is the number of matching units with that x coordinate
+
+        """
+        return np.bincount(self.x[self.mask(**filters)], minlength=self.game_map.ARENA_SIZE)
+
+    def locations(self, **filters):
+        """Gets the locations of the units matching the filters of mask
+
+        Returns:
+            A list of [x, y] locations, one per matching unit
+
+        """
+        selected = self.mask(**filters)
+        return [[int(x), int(y)] for x, y in zip(self.x[selected], self.y[selected])]
+
+    def select(self, selected):
+        """Gets the units picked out by a boolean array
+
+        Args:
+            selected: A boolean array, for example from mask or a comparison on one of the arrays
+
+        Returns:
+            A list of the selected GameUnits
+
+        """
+        return [self.units[i] for i in np.flatnonzero(selected)]
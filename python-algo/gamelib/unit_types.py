@@ -0,0 +1,149 @@
+from .unit import get_unit_templates
+
+_registries = {}
+
+
+def get_unit_type_registry(config):
+    """Gets the UnitTypeRegistry for a config, building it on first use
+
+    Args:
+        config: Contains information about the game
+
+    Returns:
+        The shared UnitTypeRegistry for that config
+
+    """
+    cached = _registries.get(id(config))
+    if cached is None or cached.config is not config:
+        cached = UnitTypeRegistry(config)
+        _registries[id(config)] = cached
+    return cached
+
+
+class UnitTypeRegistry:
+    """The unit types of a config, with their ids, categories and costs
+
+    Unit types are given integer ids in the order of config["unitInformation"]. The registry
+    is built once per config and never modified, so GameState and strategies can share it
+    between turns. Use get_unit_type_registry to get one.
+
+    Attributes :
+        * config (JSON): Contains information about the game
+        * WALL, FACTORY, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, REMOVE, UPGRADE (str): The unit type constants
+        * UNIT_TYPE_TO_INDEX (dict): Maps a unit type to its id
+        * types (tuple): types[i] is the unit type with id i
+        * STRUCTURE_TYPES (list): The structure unit types
+        * ALL_UNITS (list): The unit types that can be spawned
+        * structure_types (frozenset): The structure unit types, for fast membership tests
+        * mobile_types (frozenset): The mobile unit types
+        * all_units (frozenset): The unit types that can be spawned
+        * stationary (tuple): stationary[i] is True if the unit type with id i is a structure
+        * costs (tuple): costs[i] is the [SP, MP] cost of the unit type with id i
+        * upgrade_costs (tuple): upgrade_costs[i] is the [SP, MP] cost of upgrading the unit type with id i
+        * upgrades (tuple): upgrades[i] is the upgrade section of the config of the unit type with id i, or None if it cannot be upgraded
+        * templates (dict): Maps each unit type to the type config, UnitTemplate and upgraded UnitTemplate shared by its units
+
+    """
+    def __init__(self, config):
+        """Builds the registry
+
+        Args:
+            config: Contains information about the game
+
+        """
+        self.config = config
+        unit_information = config["unitInformation"]
+        self.types = tuple(type_config.get("shorthand") for type_config in unit_information)
+        self.UNIT_TYPE_TO_INDEX = {unit_type: type_id for type_id, unit_type in enumerate(self.types)}
+        self.WALL, self.FACTORY, self.TURRET, self.SCOUT, self.DEMOLISHER, self.INTERCEPTOR, self.REMOVE, self.UPGRADE = self.types[:8]
+
+        self.STRUCTURE_TYPES = [self.WALL, self.FACTORY, self.TURRET]
+        self.ALL_UNITS = [self.SCOUT, self.DEMOLISHER, self.INTERCEPTOR, self.WALL, self.FACTORY, self.TURRET]
+        self.structure_types = frozenset(self.STRUCTURE_TYPES)
+        self.mobile_types = frozenset((self.SCOUT, self.DEMOLISHER, self.INTERCEPTOR))
+        self.all_units = frozenset(self.ALL_UNITS)
+        self.stationary = tuple(unit_type in self.structure_types for unit_type in self.types)
+
+        costs = []
+        upgrade_costs = []
+        upgrades = []
+        for type_config in unit_information:
+            cost = (type_config.get('cost1', 0), type_config.get('cost2', 0))
+            upgrade = type_config.get('upgrade', {})
+            costs.append(cost)
+            upgrade_costs.append((upgrade.get('cost1', cost[0]), upgrade.get('cost2', cost[1])))
+            upgrades.append(type_config.get('upgrade', None))
+        self.costs = tuple(costs)
+        self.upgrade_costs = tuple(upgrade_costs)
+        self.upgrades = tuple(upgrades)
+        self.templates = get_unit_templates(config)
+
+    def type_id(self, unit_type):
+        """Gets the id of a unit type
+
+        Args:
+            unit_type: A unit type
+
+        Returns:
+            The id of the unit type, or -1 if it is not in the config
+
+        """
+        return self.UNIT_TYPE_TO_INDEX.get(unit_type, -1)
+
+    def is_stationary(self, unit_type):
+        """
+            Args:
+                unit_type: A unit type
+
+            Returns:
+                Boolean, True if the unit is stationary, False otherwise.
+        """
+        return unit_type in self.structure_types
+
+    def is_unit(self, unit_type):
+        """
+            Args:
+                unit_type: A unit type
+
+            Returns:
+                Boolean, True if the unit type can be spawned, False otherwise.
+        """
+        return unit_type in self.all_units
+
+    def cost(self, unit_type, upgrade=False):
+        """Gets the cost of a unit type
+
+        Args:
+            unit_type: A unit type
+            upgrade: If true, get the cost of upgrading it instead
+
+        Returns:
+            The costs as a list [SP, MP]
+
+        """
+        type_id = self.UNIT_TYPE_TO_INDEX[unit_type]
+        return list(self.upgrade_costs[type_id] if upgrade else self.costs[type_id])
+
+    def can_upgrade(self, unit_type):
+        """
+            Args:
+                unit_type: A unit type
+
+            Returns:
+                Boolean, True if the config has an upgrade for the unit type, False otherwise.
+        """
+        type_id = self.UNIT_TYPE_TO_INDEX.get(unit_type, -1)
+        return type_id >= 0 and self.upgrades[type_id] is not None
+
+    def template(self, unit_type, upgraded=False):
+        """Gets the UnitTemplate shared by the units of a type
+
+        Args:
+            unit_type: A mobile or structure unit type
+            upgraded: If true, get the template of upgraded units
+
+        Returns:
+            The UnitTemplate
+
+        """
+        return self.templates[unit_type][2 if upgraded else 1]
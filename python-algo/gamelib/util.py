@@ -3,6 +3,23 @@ import sys
 
 BANNER_TEXT = "---------------- Starting Your Algo --------------------"
 
+LOG_SILENT = 0
+LOG_WARNINGS = 1
+
+# The warnings of every GameState and GameMap are only printed while log_level is at least LOG_WARNINGS
+log_level = LOG_WARNINGS
+
+
+def set_log_level(level):
+    """Sets the log level for the whole algo
+
+    Args:
+        level: LOG_SILENT to skip every GameState and GameMap warning, before its message is even built, or LOG_WARNINGS to print them
+
+    """
+    global log_level
+    log_level = level
+
 
 def get_command():
     """Gets input from stdin